@@ -1,8 +1,13 @@
+from functools import partial
+from typing import Optional
+
 from mwrogue.esports_client import EsportsClient
 from esports_cog_utils import utils
-from redbot.core import commands
+from redbot.core import commands, data_manager
 
 from .autorosters_main import AutoRostersRunner
+from .job_queue import JobQueue
+from .query_cache import QueryCache
 
 
 async def is_lol_staff(ctx) -> bool:
@@ -23,26 +28,46 @@ class AutoRosters(commands.Cog):
     
     def __init__(self, bot):
         self.bot = bot
-    
+        self.query_cache = QueryCache(str(data_manager.cog_data_path(self) / 'cargo_cache.sqlite3'))
+        self.job_queue = JobQueue()
+
+    def cog_unload(self):
+        self.bot.loop.create_task(self.close())
+
+    async def close(self):
+        # Running jobs still use the query cache, so wait for them before closing it
+        await self.job_queue.close()
+        self.query_cache.close()
+
     @commands.command(pass_context=True)
     @commands.check(is_lol_staff)
     async def autorosters(self, ctx, *, overview_page):
         """Generate team rosters for the specified tournament"""
-        await ctx.send('Okay, starting now!')
         credentials = await utils.get_credentials(ctx, self.bot)
-        site = EsportsClient('lol', credentials=credentials,
-                             max_retries_mwc=0,
-                             max_retries=2, retry_interval=10)
-        overview_page = site.cache.get_target(overview_page)
-        if not site.client.pages[overview_page].exists:
+        self.job_queue.start(ctx, self.generate_rosters(ctx, credentials, overview_page))
+
+    async def generate_rosters(self, ctx, credentials, overview_page):
+        runner = await self.job_queue.run(ctx, 'lol', f'autorosters {overview_page}',
+                                          partial(self.run_runner, credentials, overview_page))
+        if runner is None:
             return await ctx.send('The tournament page does not exist!')
-        runner = AutoRostersRunner(site, overview_page)
-        runner.run()
-        username = site.credentials.username
+        username = runner.site.credentials.username
         username = username.split('@')[0] if "@" in username else username
         sandbox_page = f"\nhttps://lol.fandom.com/wiki/User:{username}/Team_Rosters_Sandbox".replace(" ", "_")
-        rosters_page = f"\nhttps://lol.fandom.com/wiki/{overview_page}/Team_Rosters".replace(" ", "_")
+        rosters_page = f"\nhttps://lol.fandom.com/wiki/{runner.overview_page}/Team_Rosters".replace(" ", "_")
         await ctx.send('Okay, done! **Remember the generated content has no coaches!**')
         await ctx.send(f'Here is the sandbox page with the new content: <{sandbox_page}>')
         await ctx.send(f'Here is where you should copy it: <{rosters_page}>')
         await runner.send_warnings(ctx)
+
+    def run_runner(self, credentials, overview_page) -> Optional[AutoRostersRunner]:
+        """Runs on the job queue's pool, since every step of it blocks on the wiki"""
+        site = EsportsClient('lol', credentials=credentials,
+                             max_retries_mwc=0,
+                             max_retries=2, retry_interval=10)
+        overview_page = site.cache.get_target(overview_page)
+        if not site.client.pages[overview_page].exists:
+            return None
+        runner = AutoRostersRunner(site, overview_page, self.query_cache)
+        runner.run()
+        return runner
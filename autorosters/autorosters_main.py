@@ -1,10 +1,15 @@
-from typing import Optional
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
 
 from esports_cog_utils.task_runner import TaskRunner
 from mwrogue.esports_client import EsportsClient
 from mwrogue.auth_credentials import AuthCredentials
 import math
 import re
+import time
+
+from .chunked_query import query_in_chunks
+from .query_cache import QueryCache
 
 
 class AutoRostersRunner(TaskRunner):
@@ -21,10 +26,17 @@ class AutoRostersRunner(TaskRunner):
         "Support": 5
     }
 
-    def __init__(self, site: EsportsClient, overview_page: str):
+    PLAYER_ID_TTL = 5 * 60
+    REVISIONS_CHUNK_SIZE = 50
+
+    # Resolved player IDs by wiki, shared across runs: {wiki: {link: (player, resolved_at)}}
+    player_id_cache: Dict[str, Dict[str, Tuple[str, float]]] = {}
+
+    def __init__(self, site: EsportsClient, overview_page: str, cache: Optional[QueryCache] = None):
         super().__init__()
         self.site = site
         self.overview_page = overview_page
+        self.cache = cache
         self.tabs: Optional[str] = None
         self.match_data = {}
         self.alt_teamnames = {}
@@ -48,8 +60,27 @@ class AutoRostersRunner(TaskRunner):
         tabs = re.search(r'{{Tabs:(.*?)}}', page_text)
         self.tabs = tabs[1] if tabs else None
 
+    def get_page_revisions(self, namespace: str, title: str) -> Dict[str, int]:
+        """Get the latest revision IDs of a page and all of its subpages"""
+        namespace_id = {name: ns for ns, name in self.site.client.namespaces.items()}[namespace]
+        base = f"{namespace}:{title}" if namespace else title
+        return {page.name: page.revision for page in self.site.client.allpages(prefix=title, namespace=namespace_id)
+                if page.name == base or page.name.startswith(base + '/')}
+
+    def get_latest_revisions(self, titles: Iterable[str]) -> Dict[str, int]:
+        """Get the latest revision IDs of pages, following redirects"""
+        titles = list(titles)
+        revisions = {}
+        for idx in range(0, len(titles), self.REVISIONS_CHUNK_SIZE):
+            response = self.site.client.api('query', prop='revisions', rvprop='ids', redirects=1,
+                                            titles='|'.join(titles[idx:idx + self.REVISIONS_CHUNK_SIZE]))
+            for page in response['query']['pages'].values():
+                if 'revisions' in page:
+                    revisions[page['title']] = page['revisions'][0]['revid']
+        return revisions
+
     def query_matchschedule_data(self):
-        matchschedule_data = self.site.cargo_client.query(
+        query = dict(
             tables="MatchSchedule=MS, MatchScheduleGame=MSG",
             fields=["MS.MatchId", "MSG.GameId", "MS.FF=MSFF", "MSG.FF=MSGFF", "MS.BestOf", "MS.Team1Final",
                     "MS.Team2Final", "MS.Team1", "MS.Team2", "MS.Winner=MatchWinner"],
@@ -57,32 +88,40 @@ class AutoRostersRunner(TaskRunner):
             where=f"MS.OverviewPage = '{self.overview_page}' AND MS.Team1 != \"TBD\" AND MS.Team2 != \"TBD\"",
             order_by="MS.N_Page, MS.N_MatchInPage, MSG.N_GameInMatch"
         )
-        return matchschedule_data
+        if self.cache is None or not (revisions := self.get_page_revisions("Data", self.overview_page)):
+            return self.site.cargo_client.query(**query)
+        # Match schedules are stored on the overview page's Data pages
+        return self.cache.query_by_page(self.site.cargo_client, wiki=self.site.wiki, page_field="MS._pageName",
+                                        revisions=revisions, **query)
 
     @staticmethod
-    def get_where_scoreboard_data(matchschedule_data):
-        where = "SG.GameId IN ({})"
+    def get_scoreboard_game_ids(matchschedule_data):
         gameids_to_query = []
         for game in matchschedule_data:
             if game["MSFF"] or game["MSGFF"]:
                 continue
             if not game["MatchWinner"]:
                 continue
-            gameids_to_query.append(f"\"{game['GameId']}\"")
-        where = where.format(" ,".join(gameids_to_query))
-        return where
+            gameids_to_query.append(game['GameId'])
+        return gameids_to_query
 
     def query_scoreboard_data(self, matchschedule_data):
-        where = self.get_where_scoreboard_data(matchschedule_data)
-        scoreboard_data = self.site.cargo_client.query(
+        query = dict(
+            key_field="SG.GameId",
+            keys=self.get_scoreboard_game_ids(matchschedule_data),
             tables="ScoreboardGames=SG, ScoreboardPlayers=SP",
             fields=["SG.OverviewPage", "SG.Team1", "SG.Team2", "SP.IngameRole", "SP.Team", "SP.Link", "SG.GameId",
                     "SG.MatchId"],
             order_by="SG.N_Page, SG.N_MatchInPage, SG.N_GameInMatch",
-            where=where,
             join_on="SG.GameId=SP.GameId"
         )
-        return scoreboard_data
+        if self.cache is None:
+            return query_in_chunks(self.site.cargo_client, **query)
+        # Scoreboards are usually stored on the overview page's Scoreboards pages.  Any that aren't
+        # are looked up by their game IDs instead.
+        return self.cache.query_by_page(self.site.cargo_client, wiki=self.site.wiki, page_field="SG._pageName",
+                                        revisions=self.get_page_revisions("", f"{self.overview_page}/Scoreboards"),
+                                        **query)
 
     def process_matchschedule_data(self, matchschedule_data):
         for match in matchschedule_data:
@@ -95,19 +134,39 @@ class AutoRostersRunner(TaskRunner):
                 self.alt_teamnames[match["Team2"]] = match["Team2Final"]
             self.match_data[match["MatchId"]]["games"][match["GameId"]] = {"msg_data": match}
 
-    def get_player_id(self, player):
-        response = self.site.cargo_client.query(
+    def get_player_ids(self, links: Iterable[str]) -> Dict[str, str]:
+        """Resolve player links through their redirects, returning a map from link to player ID
+
+        Links are looked up in chunks rather than one at a time.  Links that aren't a known player
+        resolve to themselves, and aren't cached so that a new player page or redirect is picked up
+        on the next run.  Others are cached per wiki for PLAYER_ID_TTL seconds, so that reruns
+        within a few minutes of each other don't look them all up again.
+        """
+        now = time.time()
+        cache = self.player_id_cache.setdefault(self.site.wiki, {})
+        links = {link for link in links if link}
+        to_query = sorted(link for link in links if link not in cache or now - cache[link][1] >= self.PLAYER_ID_TTL)
+        response = query_in_chunks(
+            self.site.cargo_client,
+            key_field="PR.AllName",
+            keys=to_query,
             tables="Players=P, PlayerRedirects=PR",
-            fields="P.Player",
-            where=f"PR.AllName = '{player}'",
+            fields="PR.AllName, P.Player",
             join_on="P.OverviewPage=PR.OverviewPage"
         )
-        if not response:
-            return player
-        return response[0]["Player"]
+        # Cargo compares names case-insensitively, so match the rows back up the same way
+        found = {}
+        for row in response:
+            found.setdefault(row["AllName"].lower(), row["Player"])
+        for link in to_query:
+            if (player := found.get(link.lower())) is not None:
+                cache[link] = (player, now)
+            else:
+                cache.pop(link, None)
+        return {link: cache[link][0] if link in cache else link for link in links}
 
     def process_scoreboard_data(self, scoreboard_data):
-        player_ids_cache = {}
+        player_ids = self.get_player_ids(scoreboard["Link"] for scoreboard in scoreboard_data)
 
         for scoreboard in scoreboard_data:
             game_data = self.match_data[scoreboard["MatchId"]]["games"][scoreboard["GameId"]]
@@ -116,10 +175,7 @@ class AutoRostersRunner(TaskRunner):
                     "team1": scoreboard["Team1"],
                     "team2": scoreboard["Team2"],
                     "players": {}}
-            if scoreboard["Link"] not in player_ids_cache:
-                player_id = self.get_player_id(scoreboard["Link"])
-                player_ids_cache[scoreboard["Link"]] = player_id
-            player_page = player_ids_cache[scoreboard["Link"]]
+            player_page = player_ids.get(scoreboard["Link"], scoreboard["Link"])
             game_data["sg_data"]["players"][player_page] = {"role": scoreboard["IngameRole"],
                                                             "team": scoreboard["Team"],
                                                             "link": player_page}
@@ -155,28 +211,28 @@ class AutoRostersRunner(TaskRunner):
         self.get_players_roles_data()
 
     @staticmethod
-    def get_where_player_data(rosters_data):
-        where = "PR.AllName IN ({})"
-
-        players = {}
-        for team in rosters_data.values():
-            for player in team["players"].keys():
-                if player not in players.keys():
-                    players[player] = f"\"{player}\""
-        where = where.format(" ,".join(players.values()))
-        return where
+    def get_player_names(rosters_data):
+        return sorted({player for team in rosters_data.values() for player in team["players"].keys()})
 
     def get_player_data(self):
         players_data = {}
 
-        where = self.get_where_player_data(self.rosters_data)
-        response = self.site.cargo_client.query(
+        player_names = self.get_player_names(self.rosters_data)
+        query = dict(
+            key_field="PR.AllName",
+            keys=player_names,
             tables="Players=P, PlayerRedirects=PR, Alphabets=A",
             join_on="PR.OverviewPage=P.OverviewPage, P.NameAlphabet=A.Alphabet",
-            where=where,
             fields=["CONCAT(CASE WHEN A.IsTransliterated=\"1\" THEN P.NameFull ELSE P.Name END)=name", "P.Player",
                     "P.NationalityPrimary=NP", "P.Country", "P.Residency"]
         )
+        if self.cache is None:
+            response = query_in_chunks(self.site.cargo_client, **query)
+        else:
+            # Player IDs are the titles of the player pages that the rows are stored on.  Any that
+            # aren't are looked up by name instead.
+            response = self.cache.query_by_page(self.site.cargo_client, wiki=self.site.wiki, page_field="P._pageName",
+                                                revisions=self.get_latest_revisions(player_names), **query)
 
         for player_data in response:
             player_name = player_data["name"].replace("&amp;nbsp;", " ") if player_data["name"] is not None else ""
@@ -196,58 +252,59 @@ class AutoRostersRunner(TaskRunner):
         self.rosters_data[current_teams[0]]["teamsvs"].append({f"team{n_teams[current_teams[0]]}": current_teams[1]})
         self.rosters_data[current_teams[1]]["teamsvs"].append({f"team{n_teams[current_teams[1]]}": current_teams[0]})
 
+    @staticmethod
+    def get_lineups(match, team, alt_teamnames) -> Optional[List[Dict[str, str]]]:
+        """Get the role each of a team's players played in every game of a match
+
+        Returns None if the whole match was forfeited.  Forfeited games have an empty lineup, and
+        games without a scoreboard are left out.
+        """
+        if match["ff"]:
+            return None
+        lineups = []
+        for game in match["games"].values():
+            if game["msg_data"]["MSGFF"] is not None:
+                lineups.append({})
+                continue
+            if "sg_data" not in game:
+                continue
+            lineups.append({link: player["role"] for link, player in game["sg_data"]["players"].items()
+                            if alt_teamnames[player["team"]] == team})
+        return lineups
+
+    @staticmethod
+    def get_games_by_role(link, roles, matches, lineups) -> Dict[str, str]:
+        """Build the y/n string of every role a player played, with one comma-separated entry per match"""
+        role_index = {role: i for i, role in enumerate(roles)}
+        results = [[""] * len(matches) for _ in roles]
+        for m, (match, match_lineups) in enumerate(zip(matches, lineups)):
+            if match_lineups is None:
+                forfeit = "n" * math.ceil(int(match["best_of"]) / 2)
+                for role_results in results:
+                    role_results[m] = forfeit
+                continue
+            games = [bytearray(b"n" * len(match_lineups)) for _ in roles]
+            for g, lineup in enumerate(match_lineups):
+                if link in lineup:
+                    games[role_index[lineup[link]]][g] = ord("y")
+            for role_results, role_games in zip(results, games):
+                role_results[m] = role_games.decode()
+        return {f"r{i + 1}": ",".join(role_results) for i, role_results in enumerate(results)}
+
     def process_game_data(self):
+        team_matches = defaultdict(list)
         for match in self.match_data.values():
             current_teams = [self.alt_teamnames[match["team1"]], self.alt_teamnames[match["team2"]]]
             self.add_team_vs(current_teams)
-            if match["ff"]:
-                for team in current_teams:
-                    if "players" not in self.rosters_data[team].keys():
-                        continue
-                    for player in self.rosters_data[team]["players"].values():
-                        for role in player["games_by_role"].keys():
-                            player["games_by_role"][role] += f"{'n' * math.ceil(int(match['best_of']) / 2)},"
-                continue
-            for game in match["games"].values():
-                if game["msg_data"]["MSGFF"] is not None:
-                    for team in current_teams:
-                        if "players" not in self.rosters_data[team].keys():
-                            continue
-                        for player in self.rosters_data[team]["players"].values():
-                            for role in player["games_by_role"].keys():
-                                player["games_by_role"][role] += "n"
-                    continue
-                for team in current_teams:
-                    rd_team = self.rosters_data[team]
-                    for player in rd_team["players"].keys():
-                        game_rd_player = rd_team["players"][player]
-                        if "sg_data" in game.keys():
-                            game_sg_players = game["sg_data"]["players"]
-                            if player in game_sg_players.keys():
-                                game_sg_player = game_sg_players[player]
-                                if team == self.alt_teamnames[game_sg_player["team"]]:
-                                    for role in game_rd_player["games_by_role"]:
-                                        lookup_role = role.replace("r", "role")
-                                        role_name = game_rd_player["roles_data"][lookup_role]
-                                        if role_name == game_sg_player["role"]:
-                                            game_rd_player["games_by_role"][role] += "y"
-                                        else:
-                                            game_rd_player["games_by_role"][role] += "n"
-                                    continue
-                            for role in self.rosters_data[team]["players"][player]["games_by_role"]:
-                                game_rd_player["games_by_role"][role] += "n"
             for team in current_teams:
-                rd_team = self.rosters_data[team]
-                for player in rd_team["players"].keys():
-                    game_rd_player = rd_team["players"][player]
-                    for role in game_rd_player["games_by_role"]:
-                        game_rd_player["games_by_role"][role] += ","
-        for team_data in self.rosters_data.values():
-            if "players" not in team_data.keys():
+                team_matches[team].append(match)
+        for team, matches in team_matches.items():
+            players = self.rosters_data[team].get("players")
+            if not players:
                 continue
-            for player in team_data["players"].values():
-                for role, role_data in player["games_by_role"].items():
-                    player["games_by_role"][role] = role_data[:-1]
+            lineups = [self.get_lineups(match, team, self.alt_teamnames) for match in matches]
+            for link, player in players.items():
+                player["games_by_role"] = self.get_games_by_role(link, player["roles"], matches, lineups)
 
     def get_order(self):
         sorted_teams = sorted(self.rosters_data.keys(), key=lambda x: x.lower())
@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from mwcleric.clients.cargo_client import CargoClient
+
+CHUNK_SIZE = 50
+MAX_WORKERS = 4
+
+SortColumn = Tuple[str, bool]  # (Alias, Descending)
+
+
+def quote(value: str) -> str:
+    """Quote a value for use in a Cargo where clause"""
+    return '"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def _sort_value(value: Optional[str]):
+    # Cargo returns every field as a string, so numbers have to be compared as numbers again
+    try:
+        return 0, float(value)
+    except (TypeError, ValueError):
+        return 1, value or ''
+
+
+def add_sort_fields(fields: Union[str, List[str]], order_by: Optional[str]) -> Tuple[List[str], List[SortColumn]]:
+    """Add the columns of `order_by` to `fields` under aliases, so that rows can be sorted locally"""
+    fields = [fields] if isinstance(fields, str) else list(fields)
+    sort_columns = []
+    for idx, column in enumerate(column.strip() for column in (order_by or '').split(',') if column.strip()):
+        expression, _, direction = column.partition(' ')
+        sort_columns.append((f'SortKey{idx}', direction.strip().upper() == 'DESC'))
+        fields.append(f'{expression}=SortKey{idx}')
+    return fields, sort_columns
+
+
+def sort_rows(rows: List[Dict[str, Any]], sort_columns: List[SortColumn]) -> List[Dict[str, Any]]:
+    """Sort rows fetched with add_sort_fields, then remove the added fields from them"""
+    # Stable sorts from the last column to the first leave the rows sorted by every column in turn
+    for alias, descending in reversed(sort_columns):
+        rows.sort(key=lambda row: _sort_value(row[alias]), reverse=descending)
+    aliases = {alias for alias, _ in sort_columns}
+    return [{k: v for k, v in row.items() if k not in aliases} for row in rows]
+
+
+def query_in_chunks(cargo_client: CargoClient, *, key_field: str, keys: Iterable[str],
+                    fields: Union[str, List[str]], where: Optional[str] = None, order_by: Optional[str] = None,
+                    chunk_size: int = CHUNK_SIZE, max_workers: int = MAX_WORKERS, **kwargs) -> List[Dict[str, Any]]:
+    """Run a Cargo query for rows whose `key_field` is IN `keys`, split into bounded chunks
+
+    A single IN clause holding every key can make the request too long, so the keys are split into
+    chunks of `chunk_size`, which are queried concurrently.  The rows of every chunk are then sorted
+    together by `order_by`, the same as if it had been a single query.
+    """
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return []
+    fields, sort_columns = add_sort_fields(fields, order_by)
+
+    def query(chunk: List[str]) -> List[Dict[str, Any]]:
+        chunk_where = f"{key_field} IN ({', '.join(map(quote, chunk))})"
+        return cargo_client.query(fields=fields, where=f"({where}) AND {chunk_where}" if where else chunk_where,
+                                  order_by=order_by, **kwargs)
+
+    chunks = [keys[idx:idx + chunk_size] for idx in range(0, len(keys), chunk_size)]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as pool:
+        rows = [row for result in pool.map(query, chunks) for row in result]
+    return sort_rows(rows, sort_columns)
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Set, TypeVar
+
+from redbot.core import commands
+
+logger = logging.getLogger('red.esports-wiki-cogs.autorosters')
+
+MAX_WORKERS = 2
+
+T = TypeVar('T')
+
+
+class Job:
+    """A blocking job that's waiting for, or running on, the pool"""
+
+    def __init__(self, wiki: str, name: str, task: Optional[asyncio.Task]):
+        self.wiki = wiki
+        self.name = name
+        self.task = task
+        self.queued_at = time.time()
+        self.started_at: Optional[float] = None
+
+
+class JobQueue:
+    """Runs blocking wiki jobs on a thread pool, so that they don't block the bot
+
+    At most `max_workers` jobs run at once.  Jobs on the same wiki run one at a time, in the order
+    they were submitted, so that they can't edit over each other.  The AutoRosters cog owns the
+    only instance, and other cogs submit their jobs to it.
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='wikijobs')
+        self._wiki_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._tasks: Set[asyncio.Task] = set()
+        self.jobs: List[Job] = []
+
+    async def run(self, ctx: commands.Context, wiki: str, name: str, func: Callable[[], T]) -> T:
+        """Run `func` on the pool once every earlier job on `wiki` is done, telling `ctx` when it starts"""
+        job = Job(wiki, name, asyncio.current_task())
+        ahead = sum(1 for other in self.jobs if other.wiki == wiki)
+        self.jobs.append(job)
+        try:
+            if ahead:
+                await ctx.send(f"Queued behind {ahead} other job{'s' if ahead > 1 else ''} on {wiki},"
+                               f" I'll start when {'they are' if ahead > 1 else 'it is'} done.")
+            async with self._wiki_locks[wiki]:
+                job.started_at = time.time()
+                await ctx.send('Okay, starting now!')
+                return await asyncio.get_running_loop().run_in_executor(self._executor, func)
+        finally:
+            self.jobs.remove(job)
+            if job.started_at is not None:
+                logger.info("%s on %s finished in %.1fs after waiting %.1fs", name, wiki,
+                            time.time() - job.started_at, job.started_at - job.queued_at)
+
+    def start(self, ctx: commands.Context, coro: Awaitable[None]) -> asyncio.Task:
+        """Run `coro` in the background so that the command can return, reporting any error to `ctx`"""
+        task = asyncio.create_task(self._report_errors(ctx, coro))
+        # The event loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def close(self) -> None:
+        """Cancel the jobs that haven't started yet, then wait for the running ones to finish"""
+        for job in self.jobs:
+            if job.started_at is None and job.task is not None:
+                job.task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown(wait=False)
+
+    @staticmethod
+    async def _report_errors(ctx: commands.Context, coro: Awaitable[None]) -> None:
+        try:
+            await coro
+        except asyncio.CancelledError:
+            await ctx.send("The job was cancelled because the AutoRosters cog was unloaded.")
+        except Exception:
+            logger.exception("Error in background job for command %s", ctx.command.qualified_name)
+            await ctx.send(f"Error in command '{ctx.command.qualified_name}'. Check your console or logs for details.")
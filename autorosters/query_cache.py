@@ -0,0 +1,94 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from mwcleric.clients.cargo_client import CargoClient
+
+from .chunked_query import add_sort_fields, query_in_chunks, sort_rows
+
+MAX_AGE = 30 * 24 * 60 * 60
+
+
+class QueryCache:
+    """Cargo query results kept in SQLite between runs
+
+    Results of queries over a known set of pages are stored per source page, along with the
+    revision ID the page was at.  Only pages that were edited since the last run are queried
+    again.
+    """
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS page_results"
+                             " (query TEXT, page TEXT, revision INTEGER, rows TEXT, stored REAL,"
+                             " PRIMARY KEY (query, page))")
+            self._db.execute("DELETE FROM page_results WHERE stored < ?", (time.time() - MAX_AGE,))
+
+    def close(self) -> None:
+        self._db.close()
+
+    @staticmethod
+    def _key(wiki: str, **query) -> str:
+        return json.dumps(dict(query, wiki=wiki), sort_keys=True)
+
+    def _get_pages(self, key: str, pages: List[str]) -> Dict[str, Tuple[int, str]]:
+        cached = {}
+        with self._lock:
+            # SQLite allows at most 999 parameters per statement
+            for idx in range(0, len(pages), 500):
+                chunk = pages[idx:idx + 500]
+                cached.update((page, (revision, rows)) for page, revision, rows in self._db.execute(
+                    f"SELECT page, revision, rows FROM page_results WHERE query = ? AND page IN"
+                    f" ({', '.join('?' * len(chunk))})", (key, *chunk)))
+        return cached
+
+    def query_by_page(self, cargo_client: CargoClient, *, wiki: str, page_field: str, revisions: Dict[str, int],
+                      fields: Union[str, List[str]], where: Optional[str] = None, order_by: Optional[str] = None,
+                      key_field: Optional[str] = None, keys: Optional[Iterable[str]] = None,
+                      **kwargs) -> List[Dict[str, Any]]:
+        """Run a Cargo query whose rows all come from the pages in `revisions`
+
+        `revisions` maps every page the rows can come from to its latest revision ID, and
+        `page_field` is the _pageName field of the table that's stored on those pages.  Rows from
+        pages that haven't changed since they were stored are reused.
+
+        If `key_field` and `keys` are given, only rows whose `key_field` is in `keys` are returned.
+        Keys that aren't found on any of the pages are looked up directly, without caching.
+        """
+        fields, sort_columns = add_sort_fields(fields, order_by)
+        fields.append(f'{page_field}=CachePage')
+        if key_field is not None:
+            fields.append(f'{key_field}=CacheKey')
+        key = self._key(wiki, fields=fields, where=where, **kwargs)
+
+        cached = self._get_pages(key, list(revisions))
+        stale = [page for page, revision in revisions.items() if cached.get(page, (None,))[0] != revision]
+        rows = [row for page, revision in revisions.items() if cached.get(page, (None,))[0] == revision
+                for row in json.loads(cached[page][1])]
+
+        if stale:
+            fetched = query_in_chunks(cargo_client, key_field=page_field, keys=stale, fields=fields, where=where,
+                                      **kwargs)
+            by_page = defaultdict(list)
+            for row in fetched:
+                by_page[row['CachePage']].append(row)
+            with self._lock, self._db:
+                self._db.executemany("INSERT OR REPLACE INTO page_results VALUES (?, ?, ?, ?, ?)",
+                                     [(key, page, revisions[page], json.dumps(by_page[page]), time.time())
+                                      for page in stale])
+            rows.extend(fetched)
+
+        if key_field is not None:
+            keys = set(keys)
+            rows = [row for row in rows if row['CacheKey'] in keys]
+            missing = sorted(keys - {row['CacheKey'] for row in rows})
+            rows.extend(query_in_chunks(cargo_client, key_field=key_field, keys=missing, fields=fields, where=where,
+                                        **kwargs))
+        return [{k: v for k, v in row.items() if k not in ('CachePage', 'CacheKey')}
+                for row in sort_rows(rows, sort_columns)]
+
@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from aiofiles import open as aopen
+
+AssetKey = Tuple[str, str]  # (platformGameId, asset type)
+
+
+class AssetCache:
+    """A two-tier LRU cache of game assets, keyed by game ID and asset type
+
+    Every cached asset is a file in `path`, which is kept under `disk_limit` bytes.  Recently read
+    assets are also kept in memory up to `memory_limit` bytes.  Only immutable assets should be cached.
+    """
+
+    def __init__(self, path: str, *, memory_limit: int = 32 * 2 ** 20, disk_limit: int = 2 ** 30):
+        self.path = path
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+
+        self.memory: OrderedDict[AssetKey, bytes] = OrderedDict()
+        self.memory_size = 0
+        self.disk: Optional[OrderedDict[str, int]] = None
+        self.disk_size = 0
+        self._load_lock = asyncio.Lock()
+
+    @staticmethod
+    def _file_name(key: AssetKey) -> str:
+        return hashlib.sha256('/'.join(key).encode()).hexdigest()
+
+    def _load_disk_index(self) -> None:
+        """Build the on-disk LRU order from file modification times"""
+        os.makedirs(self.path, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.tmp'):
+                # Left over from an interrupted download
+                os.remove(entry.path)
+            elif entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        entries.sort()
+        self.disk = OrderedDict((name, size) for _, name, size in entries)
+        self.disk_size = sum(self.disk.values())
+
+    async def load(self) -> None:
+        """Build the on-disk index in an executor, so the event loop isn't blocked scanning the cache"""
+        async with self._load_lock:
+            if self.disk is None:
+                await asyncio.get_running_loop().run_in_executor(None, self._load_disk_index)
+
+    async def get(self, game_id: str, asset: str) -> Optional[bytes]:
+        key = (game_id, asset)
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+
+        await self.load()
+        name = self._file_name(key)
+        if name not in self.disk:
+            return None
+        try:
+            async with aopen(os.path.join(self.path, name), 'rb') as f:
+                data = await f.read()
+        except FileNotFoundError:
+            self.disk_size -= self.disk.pop(name)
+            return None
+        os.utime(os.path.join(self.path, name))
+        self.disk.move_to_end(name)
+        self._remember(key, data)
+        return data
+
+    def get_path(self, game_id: str, asset: str) -> Optional[str]:
+        """Get the path of a cached asset's file"""
+        if self.disk is None:
+            self._load_disk_index()
+        name = self._file_name((game_id, asset))
+        if name not in self.disk:
+            return None
+        path = os.path.join(self.path, name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.disk_size -= self.disk.pop(name)
+            return None
+        self.disk.move_to_end(name)
+        return path
+
+    def temp_path(self) -> str:
+        """Get a path to download an asset to before it's added with add_file"""
+        if self.disk is None:
+            self._load_disk_index()
+        fd, path = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        os.close(fd)
+        return path
+
+    def add_file(self, game_id: str, asset: str, file_path: str) -> str:
+        """Move a downloaded asset into the cache, returning its new path"""
+        if self.disk is None:
+            self._load_disk_index()
+        name = self._file_name((game_id, asset))
+        path = os.path.join(self.path, name)
+        os.replace(file_path, path)
+        self.memory_size -= len(self.memory.pop((game_id, asset), b''))
+        self.disk_size -= self.disk.pop(name, 0)
+        self.disk[name] = os.path.getsize(path)
+        self.disk_size += self.disk[name]
+
+        while self.disk_size > self.disk_limit and len(self.disk) > 1:
+            old_name, size = self.disk.popitem(last=False)
+            self.disk_size -= size
+            try:
+                os.remove(os.path.join(self.path, old_name))
+            except FileNotFoundError:
+                pass
+        return path
+
+    def _remember(self, key: AssetKey, data: bytes) -> None:
+        """Add an asset to the in-memory tier, evicting the least recently used assets"""
+        if len(data) > self.memory_limit // 4:
+            return
+        self.memory_size -= len(self.memory.pop(key, b''))
+        self.memory[key] = data
+        self.memory_size += len(data)
+        while self.memory_size > self.memory_limit:
+            self.memory_size -= len(self.memory.popitem(last=False)[1])
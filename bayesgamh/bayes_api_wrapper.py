@@ -1,27 +1,55 @@
+import asyncio
+import itertools
 import json
 import logging
+import math
 import os
-from datetime import datetime, timedelta
-from io import BytesIO
-from typing import Any, Dict, Iterable, List, Literal, Optional, TypedDict, Union
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, FrozenSet, Iterable, List, Literal, NoReturn, Optional, Tuple, \
+    TypedDict, Union, get_args
 
 import backoff
 from aiofiles import open as aopen
-from aiohttp import ClientResponseError, ClientSession
+from aiohttp import ClientResponseError, ClientSession, ClientTimeout, TCPConnector
+from dateutil.parser import isoparse
 from redbot.core import data_manager
 from redbot.core.bot import Red
 from tsutils.errors import BadAPIKeyException, NoAPIKeyException
 
+from bayesgamh.asset_cache import AssetCache
 from bayesgamh.errors import BadRequestException
+from bayesgamh.metrics import Metrics
+from bayesgamh.rate_limiter import RateLimiter
 
 logger = logging.getLogger('red.esports-wiki-cogs.bayesgamh')
 
 GameID = str
 Tag = Union[str, Literal['NULL', 'ALL']]
 AssetType = Literal['GAMH_DETAILS', 'GAMH_SUMMARY', 'ROFL_REPLAY']
+ASSET_BITS: Dict[AssetType, int] = {asset: 1 << idx for idx, asset in enumerate(get_args(AssetType))}
 
+API_URL = "https://emh-api.bayesesports.com/"
 
-class Game(TypedDict):
+PAGE_SIZE = 999
+MAX_CONCURRENT_PAGES = 4
+
+# Asset downloads come from a separate storage host, so they get their own connection pool and
+# can't use up the connections needed by the listing calls that drive the poll loop
+API_CONNECTIONS = 8
+ASSET_CONNECTIONS = 4
+API_TIMEOUT = ClientTimeout(total=60, connect=10)
+ASSET_TIMEOUT = ClientTimeout(total=300, connect=10, sock_read=60)
+ASSET_CHUNK_SIZE = 2 ** 16
+MAX_ASSET_SIZE = 256 * 2 ** 20
+
+# How long before the access token expires that it's refreshed in the background
+REFRESH_MARGIN = timedelta(minutes=5)
+
+
+class GameData(TypedDict):
     platformGameId: GameID
     name: str
     status: str
@@ -37,49 +65,170 @@ class GetGamesResponse(TypedDict):
     page: int
     size: int
     count: int
-    games: List[Game]
+    games: List[GameData]
+
+
+class Game:
+    """A game from the API, normalised once when it's fetched
+
+    The creation time is parsed into an epoch timestamp and the assets are packed into a bitmask,
+    so that sorting and filtering games never has to reparse them.  Games without tags get the
+    NULL tag.
+    """
+    __slots__ = ('game_id', 'name', 'status', 'created_at', 'created', 'assets', 'asset_mask', 'tags', 'tag_set',
+                 'block_name', 'sub_block_name', 'team_tricodes')
+
+    def __init__(self, data: GameData):
+        self.game_id: GameID = data['platformGameId']
+        self.name: str = data['name']
+        self.status: str = data['status']
+        self.created_at: str = data['createdAt']  # ISO-8601 Formatted
+        self.created: float = isoparse(data['createdAt']).timestamp()
+        self.assets: Tuple[AssetType, ...] = tuple(data['assets'])
+        self.asset_mask: int = 0
+        for asset in self.assets:
+            self.asset_mask |= ASSET_BITS.get(asset, 0)
+        self.tags: Tuple[Tag, ...] = tuple(data['tags']) or ('NULL',)
+        self.tag_set: FrozenSet[Tag] = frozenset(self.tags)
+        self.block_name: str = data.get('blockName', '')
+        self.sub_block_name: str = data.get('subBlockName', '')
+        self.team_tricodes: List[str] = data.get('teamTriCodes', [])
+
+    def has_asset(self, asset: AssetType) -> bool:
+        return bool(self.asset_mask & ASSET_BITS[asset])
+
+    def __repr__(self) -> str:
+        return f'<Game {self.game_id}>'
 
 
 class RateLimitException(Exception):
     pass
 
 
+class GameCursor:
+    """A high-water mark used to incrementally poll the games endpoint
+
+    Only games created after `high_water - overlap` are requested, so that games which gain assets
+    shortly after being created are still picked up.  Every `full_sync_interval` a full listing is
+    made instead to reconcile any older games that changed.
+    """
+
+    def __init__(self, *, overlap: timedelta = timedelta(hours=6),
+                 full_sync_interval: timedelta = timedelta(hours=1)):
+        self.overlap = overlap
+        self.full_sync_interval = full_sync_interval
+
+        self.high_water: Optional[float] = None  # Epoch timestamp
+        self.last_full_sync: Optional[datetime] = None
+
+    def needs_full_sync(self) -> bool:
+        return (self.high_water is None or self.last_full_sync is None
+                or datetime.now(timezone.utc) - self.last_full_sync >= self.full_sync_interval)
+
+    def advance(self, games: Iterable[Game]) -> None:
+        """Move the high-water mark up to the newest game seen"""
+        for game in games:
+            if self.high_water is None or game.created > self.high_water:
+                self.high_water = game.created
+
+
+def _endpoint_name(service: str) -> str:
+    """Replace the game ID in a service path so that calls can be grouped by endpoint"""
+    return re.sub(r'games/[^/]+', 'games/{id}', service)
+
+
+def _record_retry(details: Dict[str, Any]) -> None:
+    wrapper, method, service = details['args'][:3]
+    wrapper.metrics.inc('bayes_api_retries_total', method=method, endpoint=_endpoint_name(service))
+
+
 def _data_file(file_name: str) -> str:
     return os.path.join(str(data_manager.cog_data_path(raw_name='padinfo')), file_name)
 
 
 class BayesAPIWrapper:
-    def __init__(self, bot: Red, session: ClientSession):
+    def __init__(self, bot: Red, *, asset_path: str, base_url: str = API_URL, max_asset_size: int = MAX_ASSET_SIZE,
+                 metrics: Optional[Metrics] = None):
         self.bot = bot
+        self.base_url = base_url
+        self.max_asset_size = max_asset_size
+        self.metrics = Metrics() if metrics is None else metrics
 
-        self.session = session
+        # Keep API connections alive across poll ticks
+        self.session = ClientSession(connector=TCPConnector(limit=API_CONNECTIONS, ttl_dns_cache=300,
+                                                            keepalive_timeout=75),
+                                     timeout=API_TIMEOUT)
+        self.asset_session = ClientSession(connector=TCPConnector(limit=ASSET_CONNECTIONS, ttl_dns_cache=300),
+                                           timeout=ASSET_TIMEOUT)
+        self.asset_cache = AssetCache(asset_path)
+        self.rate_limiter = RateLimiter()
 
         self.access_token = None
         self.refresh_token = None
         self.expires = datetime.min
 
+        # Only one login or refresh may be in flight at a time.  Everyone else waits for its result.
+        self._login_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def close(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        await self.session.close()
+        await self.asset_session.close()
+
     async def _ensure_login(self) -> None:
         """Ensure that the access_token is recent and valid"""
-        if self.access_token is None:
-            try:
-                async with aopen(_data_file('keys.json')) as f:
-                    data = json.loads(await f.read())
-            except FileNotFoundError:
-                return await self._new_login()
-            self.access_token = data['accessToken']
-            self.refresh_token = data['refreshToken']
-            self.expires = datetime.fromtimestamp(data['expiresIn'])
-
-        if self.expires <= datetime.now():
+        if self.access_token is not None and self.expires > datetime.now():
+            return
+
+        async with self._login_lock:
+            if self.access_token is None:
+                try:
+                    async with aopen(_data_file('keys.json')) as f:
+                        data = json.loads(await f.read())
+                except FileNotFoundError:
+                    await self._new_login()
+                else:
+                    self.access_token = data['accessToken']
+                    self.refresh_token = data['refreshToken']
+                    self.expires = datetime.fromtimestamp(data['expiresIn'])
+
+            if self.expires <= datetime.now():
+                await self._refresh_login()
+
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def _refresh_loop(self) -> NoReturn:
+        """Refresh the access token shortly before it expires"""
+        while True:
+            await asyncio.sleep(max((self.expires - REFRESH_MARGIN - datetime.now()).total_seconds(), 30))
             try:
-                data = await self._do_api_call('POST', 'login/refresh_token',
-                                               {'refreshToken': self.refresh_token})
-                self.access_token = data['accessToken']
-                self.refresh_token = data['refreshToken']
-                self.expires = datetime.now() + timedelta(seconds=data['expiresIn'])
-                await self._save_login()
-            except ClientResponseError:
-                # Invalid login (Refresh token is down)
+                async with self._login_lock:
+                    if self.expires - REFRESH_MARGIN <= datetime.now():
+                        await self._refresh_login()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error refreshing Bayes login:")
+
+    async def _refresh_login(self) -> None:
+        try:
+            data = await self._do_api_call('POST', 'login/refresh_token',
+                                           {'refreshToken': self.refresh_token})
+        except ClientResponseError:
+            # Invalid login (Refresh token is down)
+            return await self._new_login()
+        self.access_token = data['accessToken']
+        self.refresh_token = data['refreshToken']
+        self.expires = datetime.now() + timedelta(seconds=data['expiresIn'])
+        await self._save_login()
+
+    async def _replace_login(self, rejected_token: Optional[str]) -> None:
+        """Log in again after the API rejected a token, unless another caller already did"""
+        async with self._login_lock:
+            if self.access_token == rejected_token:
                 await self._new_login()
 
     async def _new_login(self) -> None:
@@ -109,43 +258,59 @@ class BayesAPIWrapper:
                 'expiresIn': self.expires.timestamp()
             }))
 
-    @backoff.on_exception(backoff.expo, RateLimitException, logger=None)
+    @backoff.on_exception(backoff.expo, RateLimitException, max_value=60, max_time=600, logger=None,
+                          on_backoff=_record_retry)
     async def _do_api_call(self, method: Literal['GET', 'POST'], service: str,
                            data: Dict[str, Any] = None, *, allow_retry: bool = True):
         """Make a single API call to emh-api.bayesesports.com"""
-        endpoint = "https://emh-api.bayesesports.com/"
+        endpoint = self.base_url
         if data is None:
             data = {}
 
-        if method == "GET":
-            async with self.session.get(endpoint + service, headers=await self._get_headers(), params=data) as resp:
-                if resp.status == 401 and allow_retry:
-                    await self._new_login()
-                    return await self._do_api_call(method, service, data, allow_retry=False)
-                elif resp.status == 429:
-                    raise RateLimitException()
-                resp.raise_for_status()
-                data = await resp.json()
-        elif method == "POST":
-            async with self.session.post(endpoint + service, json=data) as resp:
-                resp.raise_for_status()
-                data = await resp.json()
-        else:
-            raise ValueError("HTTP Method must be GET or POST.")
-        return data
+        status = 'error'
+        start = time.perf_counter()
+        try:
+            if method == "GET":
+                headers = await self._get_headers()
+                token = self.access_token
+                await self.rate_limiter.acquire()
+                start = time.perf_counter()
+                async with self.session.get(endpoint + service, headers=headers, params=data) as resp:
+                    status = resp.status
+                    if resp.status == 401 and allow_retry:
+                        await self._replace_login(token)
+                        return await self._do_api_call(method, service, data, allow_retry=False)
+                    elif resp.status == 429:
+                        self.rate_limiter.on_rate_limited(resp.headers)
+                        raise RateLimitException()
+                    resp.raise_for_status()
+                    self.rate_limiter.on_success(resp.headers)
+                    body = await resp.read()
+            elif method == "POST":
+                await self.rate_limiter.acquire()
+                start = time.perf_counter()
+                async with self.session.post(endpoint + service, json=data) as resp:
+                    status = resp.status
+                    if resp.status == 429:
+                        self.rate_limiter.on_rate_limited(resp.headers)
+                        raise RateLimitException()
+                    resp.raise_for_status()
+                    self.rate_limiter.on_success(resp.headers)
+                    body = await resp.read()
+            else:
+                raise ValueError("HTTP Method must be GET or POST.")
+        finally:
+            labels = {'method': method, 'endpoint': _endpoint_name(service), 'status': status}
+            self.metrics.observe('bayes_api_request_seconds', time.perf_counter() - start, **labels)
+            self.metrics.inc('bayes_api_requests_total', **labels)
+        self.metrics.inc('bayes_api_response_bytes_total', len(body), endpoint=_endpoint_name(service))
+        return json.loads(body)
 
     async def _get_headers(self) -> Dict[str, str]:
         """Return headers for a GET request to the API"""
         await self._ensure_login()
         return {'Authorization': f'Bearer {self.access_token}'}
 
-    @staticmethod
-    def _clean_game(game: Game) -> Game:
-        """Add the NULL tag to a game with no tags."""
-        if not game['tags']:
-            game['tags'].append('NULL')
-        return game
-
     async def get_tags(self) -> List[Tag]:
         """Return a list of tags that can be used to request games"""
         return ['NULL', 'ALL'] + await self._do_api_call('GET', 'api/v1/tags')
@@ -186,20 +351,45 @@ class BayesAPIWrapper:
         elif "NULL" in tags or "ALL" in tags:
             raise ValueError("The special tags NULL and ALL must be requested alone.")
 
-        data = await self.get_games(tags=tags, page_size=999,
+        data = await self.get_games(tags=tags, page_size=PAGE_SIZE,
                                     from_timestamp=from_timestamp,
                                     to_timestamp=to_timestamp)
-        if data['count'] >= 999:
-            page = 1
-            while len(data['games']) < data['count']:
-                newpage = await self.get_games(tags=tags, page=page, page_size=999,
-                                               from_timestamp=from_timestamp,
-                                               to_timestamp=to_timestamp)
-                data['games'].extend(newpage['games'])
-                if not newpage['games']:
-                    break
-                page += 1
-        return [self._clean_game(game) for game in data['games'] if not (game['tags'] and only_null)]
+        pages = [data['games']]
+        if data['count'] > len(data['games']):
+            # The unpaged request returns the first page, so fetch the ones after it concurrently
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_PAGES)
+
+            async def get_page(page: int) -> List[GameData]:
+                async with semaphore:
+                    return (await self.get_games(tags=tags, page=page, page_size=PAGE_SIZE,
+                                                 from_timestamp=from_timestamp,
+                                                 to_timestamp=to_timestamp))['games']
+
+            first, last = data['page'], data['page'] + math.ceil(data['count'] / PAGE_SIZE)
+            pages.extend(await asyncio.gather(*(get_page(page) for page in range(first + 1, last))))
+            # Games created while paging shift everything down, so keep going until the count is reached
+            while sum(map(len, pages)) < data['count'] and pages[-1]:
+                pages.append(await get_page(last))
+                last += 1
+
+        games = {}
+        for game in itertools.chain.from_iterable(pages):
+            games.setdefault(game['platformGameId'], game)
+        return [Game(game) for game in games.values() if not (game['tags'] and only_null)]
+
+    async def get_updated_games(self, cursor: GameCursor) -> List[Game]:
+        """Get all games created since the cursor's high-water mark
+
+        If the cursor is due for a full reconciliation, all games are returned instead.
+        """
+        if cursor.needs_full_sync():
+            games = await self.get_all_games()
+            cursor.last_full_sync = datetime.now(timezone.utc)
+        else:
+            since = datetime.fromtimestamp(cursor.high_water, timezone.utc) - cursor.overlap
+            games = await self.get_all_games(from_timestamp=since)
+        cursor.advance(games)
+        return games
 
     async def get_game(self, game_id: GameID) -> Game:
         """Get a game by its ID"""
@@ -209,14 +399,61 @@ class BayesAPIWrapper:
             if e.status == 404:
                 raise BadRequestException(f'Invalid Game ID: {game_id}')
             raise
-        return self._clean_game(game)
+        return Game(game)
+
+    async def get_asset(self, game_id: GameID, asset: AssetType, *, game: Optional[Game] = None) -> bytes:
+        """Get the bytes for an asset
+
+        If the game has already been fetched, pass it in to skip looking it up again.
+        """
+        if (blob := await self.asset_cache.get(game_id, asset)) is not None:
+            self.metrics.inc('bayes_asset_cache_total', asset=asset, result='hit')
+            return blob
+        # The cache was just checked, so open_asset counts this lookup as a miss
+        async with self.open_asset(game_id, asset, game=game) as path:
+            async with aopen(path, 'rb') as f:
+                return await f.read()
 
-    async def get_asset(self, game_id: GameID, asset: AssetType) -> bytes:
-        """Get the bytes for an asset"""
-        game = await self.get_game(game_id)
-        if asset not in game['assets']:
+    @asynccontextmanager
+    async def open_asset(self, game_id: GameID, asset: AssetType, *,
+                         game: Optional[Game] = None) -> AsyncIterator[str]:
+        """Download an asset to a file and yield its path
+
+        The asset is streamed to disk, so it's never held in memory.  Assets of finished games don't
+        change, so they're kept in the asset cache.  Other assets are deleted on exit.
+        """
+        await self.asset_cache.load()
+        if (path := self.asset_cache.get_path(game_id, asset)) is not None:
+            self.metrics.inc('bayes_asset_cache_total', asset=asset, result='hit')
+            yield path
+            return
+        self.metrics.inc('bayes_asset_cache_total', asset=asset, result='miss')
+        if game is None:
+            game = await self.get_game(game_id)
+        if asset not in game.assets:
             raise BadRequestException(f'Invalid asset type for game with ID {game_id}: {asset}')
         data = await self._do_api_call('GET', f'api/v1/games/{game_id}/download', {'type': asset})
-        fp = BytesIO()
-        async with self.session.get(data['url']) as resp:
-            return await resp.read()
+
+        tmp_path = self.asset_cache.temp_path()
+        try:
+            with self.metrics.timer('bayes_asset_download_seconds', asset=asset):
+                async with self.asset_session.get(data['url']) as resp:
+                    resp.raise_for_status()
+                    if resp.content_length is not None and resp.content_length > self.max_asset_size:
+                        raise BadRequestException(f'The {asset} asset for game with ID {game_id} is too large.')
+                    size = 0
+                    async with aopen(tmp_path, 'wb') as f:
+                        async for chunk in resp.content.iter_chunked(ASSET_CHUNK_SIZE):
+                            size += len(chunk)
+                            if size > self.max_asset_size:
+                                raise BadRequestException(f'The {asset} asset for game with ID {game_id}'
+                                                          f' is too large.')
+                            await f.write(chunk)
+            self.metrics.inc('bayes_asset_bytes_total', size, asset=asset)
+            if game.status == 'FINISHED':
+                yield self.asset_cache.add_file(game_id, asset, tmp_path)
+            else:
+                yield tmp_path
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
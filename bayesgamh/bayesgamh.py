@@ -1,35 +1,50 @@
 import asyncio
-import json
+import itertools
 import logging
+import os
 import time
-from collections import defaultdict
-from datetime import datetime, time as dt_time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, time as dt_time, timedelta
+from functools import partial
 from io import BytesIO
-from typing import Any, Callable, Coroutine, Iterable, List, NoReturn, Optional, Sequence
+from typing import Any, Callable, Coroutine, Dict, Iterable, List, NoReturn, Optional, Sequence, Tuple
 
-import aiohttp
 import discord
-from dateutil.parser import isoparse
 from discord import DMChannel, TextChannel, User
 from esports_cog_utils.utils import login_if_possible
 from mwrogue.esports_client import EsportsClient
 from pytz import utc
-from redbot.core import Config, commands
+from redbot.core import Config, commands, data_manager
 from redbot.core.bot import Red
 from redbot.core.commands import UserInputOptional
 from redbot.core.utils.chat_formatting import box, inline, pagify, spoiler
 from tsutils.cogs.globaladmin import auth_check, has_perm
 from tsutils.errors import ClientInlineTextException
-from tsutils.helper_functions import repeating_timer
 from tsutils.user_interaction import cancellation_message, confirmation_message, get_user_confirmation, \
     send_cancellation_message
 
-from bayesgamh.bayes_api_wrapper import AssetType, BayesAPIWrapper, Game, Tag
+from bayesgamh.bayes_api_wrapper import BayesAPIWrapper, Game, GameID, Tag
+from bayesgamh.change_source import ChangeSource, PollingChangeSource, WebhookChangeSource
 from bayesgamh.converters import DateConverter
+from bayesgamh.delivery import DeliveryQueue
 from bayesgamh.errors import BadRequestException
+from bayesgamh.game_catalog import GameCatalog
+from bayesgamh.game_state import GameStateStore
+from bayesgamh.metrics import Metrics
+from bayesgamh.subscription_index import SubscriptionIndex
+from bayesgamh.summary import GameSummary, parse_summary
 
 logger = logging.getLogger('red.esports-wiki-cogs.bayesgamh')
 
+GameRender = Tuple[str, str]  # (Without spoiler tags, With spoiler tags)
+
+WIKI_QUERY_CHUNK_SIZE = 100
+WIKI_GAME_ID_TTL = 24 * 60 * 60
+SUMMARY_CACHE_SIZE = 10000
+
+# Games created this recently may still gain assets, so they keep the poll loop at its fastest
+ACTIVE_WINDOW = timedelta(hours=3)
+
 
 async def is_editor(ctx) -> bool:
     GAMHCOG = ctx.bot.get_cog("BayesGAMH")
@@ -52,13 +67,29 @@ class BayesGAMH(commands.Cog):
         super().__init__(*args, **kwargs)
         self.bot = bot
 
-        self.session = aiohttp.ClientSession()
         self.config = Config.get_conf(self, identifier=847356477)
         self.config.register_global(seen={}, allowed_channels={}, autochannel_seen={}, auto_channels={},
-                                    invalid_games={})
+                                    invalid_games={}, seen_buckets={}, autochannel_seen_buckets={},
+                                    invalid_game_buckets={}, retention_days=180, retention_floor=0,
+                                    webhook_port=None, webhook_host='127.0.0.1', min_poll_interval=60,
+                                    max_poll_interval=15 * 60, prometheus_export=False)
         self.config.register_user(allowed_tags={}, subscriptions={}, jsononly=True)
 
-        self.api = BayesAPIWrapper(bot, self.session)
+        self.metrics = Metrics()
+        self.api = BayesAPIWrapper(bot, asset_path=str(data_manager.cog_data_path(self) / 'assets'),
+                                   metrics=self.metrics)
+        self.catalog = GameCatalog(self.api)
+        self.delivery = DeliveryQueue(metrics=self.metrics)
+        self.subscription_index = SubscriptionIndex(self.config)
+        self.wiki_game_ids: Dict[GameID, float] = {}
+        self.summaries: OrderedDict[GameID, GameSummary] = OrderedDict()
+        self.seen = GameStateStore(self.config.seen_buckets, self.config.seen, catalog=self.catalog,
+                                   cutoff=self.get_retention_cutoff, metrics=self.metrics)
+        self.autochannel_seen = GameStateStore(self.config.autochannel_seen_buckets, self.config.autochannel_seen,
+                                               catalog=self.catalog, cutoff=self.get_retention_cutoff,
+                                               metrics=self.metrics)
+        self.invalid_games = GameStateStore(self.config.invalid_game_buckets, self.config.invalid_games,
+                                            catalog=self.catalog, metrics=self.metrics)
 
         self._loop = bot.loop.create_task(self.do_loop())
         self.subscription_lock = asyncio.Lock()
@@ -78,70 +109,154 @@ class BayesGAMH(commands.Cog):
     async def red_delete_data_for_user(self, *, requester, user_id):
         """Delete a user's personal data."""
         await self.config.user_from_id(user_id).subscriptions.set({})
+        await self.subscription_index.reload_user(user_id)
 
     def cog_unload(self):
         self._loop.cancel()
-        self.bot.loop.create_task(self.session.close())
+        self.bot.loop.create_task(self.close())
+
+    async def close(self) -> None:
+        # Games are marked as seen before their messages go out, so send what's queued before stopping
+        await self.delivery.close()
+        await self.api.close()
 
     async def do_loop(self) -> NoReturn:
+        source = await self.get_change_source()
         try:
-            async for _ in repeating_timer(60):
+            try:
+                await source.start()
+            except OSError:
+                logger.exception("Unable to start the webhook listener. Falling back to polling:")
+                await source.close()
+                source = await self.get_polling_source()
+            while True:
                 try:
-                    await self.do_auto_channel()
-                    await self.do_subscriptions()
+                    with self.metrics.timer('bayesgamh_tick_seconds'):
+                        with self.metrics.timer('bayesgamh_phase_seconds', phase='refresh'):
+                            await self.catalog.refresh(force=True)
+                        renders = {}
+                        await self.do_auto_channel(renders)
+                        await self.do_subscriptions(renders)
+                        source.record_activity(await self.is_active())
+                    self.metrics.inc('bayesgamh_ticks_total')
+                    if await self.config.prometheus_export():
+                        await self.export_metrics()
                 except asyncio.CancelledError:
                     raise
                 except Exception:
                     logger.exception("Error in loop:")
+                await source.wait()
         except asyncio.CancelledError:
             return
+        finally:
+            await source.close()
+
+    async def get_change_source(self) -> ChangeSource:
+        if (port := await self.config.webhook_port()) is None:
+            return await self.get_polling_source()
+        if not (secret := (await self.bot.get_shared_api_tokens("bayes")).get('webhook_secret')):
+            logger.warning("No webhook secret is set. Falling back to polling.")
+            return await self.get_polling_source()
+        return WebhookChangeSource(await self.config.webhook_host(), port, secret=secret)
+
+    async def get_polling_source(self) -> PollingChangeSource:
+        return PollingChangeSource(await self.config.min_poll_interval(), await self.config.max_poll_interval())
+
+    async def is_active(self) -> bool:
+        """Whether any games are live or were created recently"""
+        now = datetime.now(utc)
+        active_since = (now - ACTIVE_WINDOW).timestamp()
+        for game in await self.catalog.get_games(since=now - timedelta(days=1)):
+            if game.status != 'FINISHED' or game.created > active_since:
+                return True
+        return False
 
-    async def do_subscriptions(self) -> None:
-        async with self.subscription_lock, self.config.seen() as seen:
-            tags_to_uid = defaultdict(set)
-            for u_id, data in (await self.config.all_users()).items():
-                for sub in data['subscriptions']:
-                    tags_to_uid[sub].add(u_id)
-
+    async def restart_loop(self) -> None:
+        self._loop.cancel()
+        await asyncio.gather(self._loop, return_exceptions=True)
+        self._loop = self.bot.loop.create_task(self.do_loop())
+
+    async def do_subscriptions(self, renders: Optional[Dict[GameID, GameRender]] = None) -> None:
+        if renders is None:
+            renders = {}
+        cutoff = await self.get_retention_cutoff()
+        async with self.subscription_lock, self.seen as seen:
+            seen.prune(cutoff)
             changed_games = []
-            for game in await self.api.get_all_games():
-                if seen.get(game['platformGameId'], -1) != len(game['assets']):  # Different number of assets
-                    changed_games.append(game)
-
-            for u_id, data in (await self.config.all_users()).items():
-                if (user := self.bot.get_user(u_id)) is None:
-                    logger.warning(f"Failed to find user with ID {u_id} for subscription.")
-                    continue
-                msg = [await self.format_game_long(game, user)
-                       for game in sorted([game for game in changed_games
-                                           if any(u_id in tags_to_uid[tag].union(tags_to_uid['ALL'])
-                                                  for tag in game['tags'])
-                                           and ('GAMH_DETAILS' in game['assets'] or not data['jsononly'])
-                                           and await self.has_access(user, *game['tags'])],
-                                          key=lambda g: isoparse(g['createdAt']))]
-                try:
-                    for page in pagify('\n\n'.join(msg)):
-                        await user.send(page)
-                except discord.Forbidden:
-                    logger.warning(f"Unable to send subscription message to user {user}. (Forbidden)")
+            with self.metrics.timer('bayesgamh_phase_seconds', phase='diff'):
+                for game in await self.catalog.get_games(since=cutoff):
+                    if seen.get(game.game_id, -1) != len(game.assets):  # Different number of assets
+                        changed_games.append(game)
 
+            users = {}
+            msgs = defaultdict(list)
             for game in changed_games:
-                seen[game['platformGameId']] = len(game['assets'])
+                for u_id in await self.subscription_index.get_subscribers(game.tags):
+                    if not (game.has_asset('GAMH_DETAILS') or not self.subscription_index.jsononly[u_id]):
+                        continue
+                    if u_id not in users:
+                        users[u_id] = self.bot.get_user(u_id)
+                        if users[u_id] is None:
+                            logger.warning(f"Failed to find user with ID {u_id} for subscription.")
+                    if users[u_id] is None or not await self.has_access(users[u_id], *game.tags):
+                        continue
+                    if game.game_id not in renders:
+                        with self.metrics.timer('bayesgamh_phase_seconds', phase='render'):
+                            renders[game.game_id] = await self.render_game_long(game)
+                    plain, spoilered = renders[game.game_id]
+                    subs = self.subscription_index.subscriptions[u_id]
+                    msgs[u_id].append(spoilered if self.use_spoiler_tags(game, subs) else plain)
+
+            for u_id, msg in msgs.items():
+                self.delivery.put(users[u_id], *pagify('\n\n'.join(msg)))
 
-    async def do_auto_channel(self) -> None:
-        async with self.config.autochannel_seen() as seen:
-            changed_games = sorted((game for game in await self.api.get_all_games()
-                                    if seen.get(game['platformGameId'], -1) != len(game['assets'])),
-                                   key=lambda g: isoparse(g['createdAt']))
-            msg = [await self.format_game_long(game, None) for game in changed_games if 'GAMH_DETAILS' in game['assets']]
+            for game in changed_games:
+                seen.set(game, len(game.assets))
+
+    async def do_auto_channel(self, renders: Optional[Dict[GameID, GameRender]] = None) -> None:
+        if renders is None:
+            renders = {}
+        cutoff = await self.get_retention_cutoff()
+        async with self.autochannel_seen as seen:
+            seen.prune(cutoff)
+            with self.metrics.timer('bayesgamh_phase_seconds', phase='diff'):
+                changed_games = [game for game in await self.catalog.get_games(since=cutoff)
+                                 if seen.get(game.game_id, -1) != len(game.assets)]
+            msg = []
+            for game in changed_games:
+                if not game.has_asset('GAMH_DETAILS'):
+                    continue
+                if game.game_id not in renders:
+                    with self.metrics.timer('bayesgamh_phase_seconds', phase='render'):
+                        renders[game.game_id] = await self.render_game_long(game)
+                msg.append(renders[game.game_id][0])
 
             for cid in await self.config.auto_channels():
                 if None is not (channel := self.bot.get_channel(int(cid))):
-                    for page in pagify('\n\n'.join(msg)):
-                        await channel.send(page)
+                    self.delivery.put(channel, *pagify('\n\n'.join(msg)))
 
             for game in changed_games:
-                seen[game['platformGameId']] = len(game['assets'])
+                seen.set(game, len(game.assets))
+
+    async def export_metrics(self) -> None:
+        """Write the metrics where a Prometheus node exporter's textfile collector can pick them up"""
+        self.update_gauges()
+        path = data_manager.cog_data_path(self) / 'metrics.prom'
+        tmp_path = path.with_suffix('.prom.tmp')
+        tmp_path.write_text(self.metrics.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def update_gauges(self) -> None:
+        for name, value in self.api.rate_limiter.metrics().items():
+            self.metrics.set_gauge(f'bayes_rate_limiter_{name}', value)
+        self.metrics.set_gauge('bayesgamh_delivery_pending', sum(map(len, self.delivery.pending.values())))
+        self.metrics.set_gauge('bayesgamh_catalog_games', len(self.catalog.games))
+
+    async def get_retention_cutoff(self) -> datetime:
+        """Games created before this are no longer tracked for subscriptions and auto-channels"""
+        cutoff = datetime.now(utc) - timedelta(days=await self.config.retention_days())
+        # Games from before the floor were already pruned, so they'd otherwise look new again
+        return max(cutoff, datetime.fromtimestamp(await self.config.retention_floor(), utc))
 
     @commands.group()
     @commands.check(is_editor)
@@ -162,6 +277,7 @@ class BayesGAMH(commands.Cog):
                 tags[tag] = {'date': time.time()}
             else:
                 return await ctx.send(f"{user} already has access to `{tag}`.")
+        await self.subscription_index.reload_user(user.id)
         await ctx.tick()
 
     @mh_tag.command(name='remove', aliases=['rm', 'delete', 'del'])
@@ -178,6 +294,7 @@ class BayesGAMH(commands.Cog):
                         subs.pop(tag)
             else:
                 return await ctx.send(f"{user} already doesn't have access to `{tag}`.")
+        await self.subscription_index.reload_user(user.id)
         await ctx.tick()
 
     @mh_tag.group(name='list')
@@ -298,8 +415,10 @@ class BayesGAMH(commands.Cog):
         """
         if not await self.has_access(ctx.author, tag):
             return await ctx.send(f"You do not have permission to query the tag `{tag}`.")
-        games = sorted(await self.api.get_all_games(tag=tag), key=lambda g: isoparse(g['createdAt']), reverse=True)
-        ret = [await self.format_game(game, ctx.author) for game in games[:limit][::-1]]
+        if limit < 1:
+            return await send_cancellation_message(ctx, "The limit must be at least 1.")
+        games = list(itertools.islice(await self.catalog.iter_games(tag=tag, newest_first=True), limit))
+        ret = [await self.format_game(game, ctx.author) for game in reversed(games)]
         if not ret:
             return await ctx.send(f"There are no games with tag `{tag}`."
                                   f" Make sure the tag is valid and correctly cased.")
@@ -326,12 +445,8 @@ class BayesGAMH(commands.Cog):
     @mh_query.command(name='since')
     async def mh_q_since(self, ctx, date: DateConverter, limit: UserInputOptional[int] = 50, *, tag):
         """Get only games since a specific date"""
-
-        async def filt(games: Iterable[Game]) -> Iterable[Game]:
-            return (game for game in games if isoparse(game['createdAt']) > datetime.combine(date, dt_time(), utc))
-
         ret = [await self.format_game(game, ctx.author) for game in
-               await self.mh_game_filter(ctx, tag, filt, limit)]
+               await self.mh_game_filter(ctx, tag, None, limit, since=datetime.combine(date, dt_time(), utc))]
 
         if not ret:
             return await ctx.send(f"There are no new games with tag `{tag}`.")
@@ -348,7 +463,8 @@ class BayesGAMH(commands.Cog):
     @auth_check('mhadmin')
     async def mh_q_getasset(self, ctx, game_id, asset):
         """Get a match asset by game_id and asset name"""
-        await ctx.send(file=discord.File(BytesIO(await self.api.get_asset(game_id, asset)), asset + '.json'))
+        async with self.api.open_asset(game_id, asset) as path:
+            await ctx.send(file=discord.File(path, asset + '.json'))
 
     @mhtool.group(name='query2')
     async def mh_query2(self, ctx):
@@ -388,12 +504,8 @@ class BayesGAMH(commands.Cog):
     @mh_query2.command(name='since')
     async def mh_q2_since(self, ctx, date: DateConverter, limit: UserInputOptional[int] = 50, *, tag):
         """Get only games since a specific date"""
-
-        async def filt(games: Iterable[Game]) -> Iterable[Game]:
-            return (game for game in games if isoparse(game['createdAt']) > datetime.combine(date, dt_time(), utc))
-
         ret = [await self.format_game_long(game, ctx.author) for game in
-               await self.mh_game_filter(ctx, tag, filt, limit)]
+               await self.mh_game_filter(ctx, tag, None, limit, since=datetime.combine(date, dt_time(), utc))]
 
         if not ret:
             return await ctx.send(f"There are no new games with tag `{tag}`.")
@@ -403,17 +515,30 @@ class BayesGAMH(commands.Cog):
 
     async def mh_game_filter(self, ctx, tag: Tag,
                              f: Optional[Callable[[Sequence[Game]], Coroutine[None, None, Iterable[Game]]]],
-                             limit: int) -> Iterable[Game]:
-        if f is None:
-            async def f(_): return _
+                             limit: int, *, since: Optional[datetime] = None) -> List[Game]:
+        """Get the `limit` most recent valid games with a tag that pass the filter, oldest first
+
+        Games are read newest first and filtered in batches, so only as many games are looked at as
+        are needed to find `limit` of them.
+        """
         if not await self.has_access(ctx.author, tag):
             raise ClientInlineTextException(f"You do not have permission to query the tag `{tag}`.")
-        games = sorted(await self.api.get_all_games(tag=tag), key=lambda g: isoparse(g['createdAt']), reverse=True)
-        if not games:
+        if limit < 1:
+            raise ClientInlineTextException("The limit must be at least 1.")
+        games = await self.catalog.iter_games(tag=tag, since=since, newest_first=True)
+        found = []
+        looked = 0
+        while len(found) < limit:
+            if not (batch := list(itertools.islice(games, max(limit - len(found), WIKI_QUERY_CHUNK_SIZE)))):
+                break
+            looked += len(batch)
+            async with self.invalid_games as invalid_games:
+                batch = [game for game in batch if game.game_id not in invalid_games]
+            found.extend(batch if f is None else await f(batch))
+        if not looked and since is None:
             raise ClientInlineTextException(f"There are no games with tag `{tag}`."
                                             f" Make sure the tag is valid and correctly cased.")
-        invalid_games = await self.config.invalid_games()
-        return await f([game for game in games[:limit][::-1] if game['platformGameId'] not in invalid_games])
+        return list(reversed(found[:limit]))
 
     @mhtool.group(name='subscription', aliases=['subscriptions', 'subscribe'])
     async def mh_subscription(self, ctx):
@@ -434,10 +559,12 @@ class BayesGAMH(commands.Cog):
                                                             f" have permission to view it. Contact a bot admin"
                                                             f" if you think this is an issue.")
             await self.do_subscriptions()
-            async with self.config.seen() as seen:
-                for game in await self.api.get_all_games(tag=tag):
-                    seen[game['platformGameId']] = len(game['assets'])
+            cutoff = await self.get_retention_cutoff()
+            async with self.seen as seen:
+                for game in await self.catalog.get_games(tag=tag, since=cutoff):
+                    seen.set(game, len(game.assets))
             subs[tag] = {'date': time.time(), 'spoiler': False}
+        await self.subscription_index.reload_user(ctx.author.id)
         await ctx.tick()
 
     @mh_subscription.command(name='remove', aliases=['rm', 'delete', 'del'])
@@ -447,6 +574,7 @@ class BayesGAMH(commands.Cog):
             if tag not in subs:
                 return await ctx.send("You're not subscribed to that tag.")
             subs.pop(tag)
+        await self.subscription_index.reload_user(ctx.author.id)
         await ctx.tick()
 
     @mh_subscription.command(name='list')
@@ -463,6 +591,7 @@ class BayesGAMH(commands.Cog):
         if not await get_user_confirmation(ctx, "Are you sure you want to clear all of your subscriptions?"):
             return await ctx.react_quietly("\N{CROSS MARK}")
         await self.config.user(ctx.author).subscriptions.set({})
+        await self.subscription_index.reload_user(ctx.author.id)
         await ctx.tick()
 
     @mh_subscription.group(name='set', aliases=['settings'])
@@ -475,6 +604,7 @@ class BayesGAMH(commands.Cog):
             if tag not in subs:
                 return await ctx.send("You're not subscribed to that tag.")
             subs[tag]['spoiler'] = True
+        await self.subscription_index.reload_user(ctx.author.id)
         await ctx.tick()
 
     @mh_s_set.command(name='unspoiler')
@@ -483,6 +613,7 @@ class BayesGAMH(commands.Cog):
             if tag not in subs:
                 return await ctx.send("You're not subscribed to that tag.")
             subs[tag]['spoiler'] = False
+        await self.subscription_index.reload_user(ctx.author.id)
         await ctx.tick()
 
     @mh_subscription.group(name='show')
@@ -502,7 +633,79 @@ class BayesGAMH(commands.Cog):
     @mh_prefs.command(name='jsononly', aliases=['onlyjson'])
     async def mh_p_jsononly(self, ctx, enable: bool):
         """Only get subscription messages when a game has assets"""
-        await self.config.user(ctx.user).jsononly.set(enable)
+        await self.config.user(ctx.author).jsononly.set(enable)
+        await self.subscription_index.reload_user(ctx.author.id)
+        await ctx.tick()
+
+    @mhtool.command(name='retention')
+    @auth_check('mhadmin')
+    async def mh_retention(self, ctx, days: Optional[int] = None):
+        """Set how many days games are tracked for subscriptions and auto-channels
+
+        Leave days unfilled to see the current setting.
+        """
+        if days is None:
+            return await ctx.send(f"Games are tracked for {await self.config.retention_days()} days.")
+        if days < 1:
+            return await send_cancellation_message(ctx, "Games must be tracked for at least 1 day.")
+        if days > await self.config.retention_days():
+            await self.config.retention_floor.set((await self.get_retention_cutoff()).timestamp())
+        await self.config.retention_days.set(days)
+        await ctx.tick()
+
+    @mhtool.command(name='pollinterval')
+    @auth_check('mhadmin')
+    async def mh_pollinterval(self, ctx, minimum: Optional[int] = None, maximum: Optional[int] = None):
+        """Set the bounds in seconds on how often Bayes is checked for new games
+
+        Checks happen every `minimum` seconds while games are live, and back off to every `maximum`
+        seconds when nothing is going on.  Leave both unfilled to see the current bounds.
+        """
+        if minimum is None:
+            return await ctx.send(f"Bayes is checked every {await self.config.min_poll_interval()} to"
+                                  f" {await self.config.max_poll_interval()} seconds.")
+        if maximum is None:
+            maximum = minimum
+        if not 10 <= minimum <= maximum:
+            return await send_cancellation_message(ctx, "The minimum must be at least 10 seconds"
+                                                        " and no more than the maximum.")
+        await self.config.min_poll_interval.set(minimum)
+        await self.config.max_poll_interval.set(maximum)
+        await self.restart_loop()
+        await ctx.tick()
+
+    @mhtool.command(name='webhook')
+    @commands.is_owner()
+    async def mh_webhook(self, ctx, port: Optional[int] = None, host: str = '127.0.0.1'):
+        """Listen for pushed game notifications on a port instead of polling every minute
+
+        A secret must first be set with `[p]set api bayes webhook_secret <SECRET>`, and
+        notifications must send it in their X-Webhook-Secret header.  Only local connections are
+        accepted unless another host to listen on is given.  Leave port unfilled to go back to polling.
+        """
+        if port is not None and not (await self.bot.get_shared_api_tokens("bayes")).get('webhook_secret'):
+            return await send_cancellation_message(ctx, f"Set a secret with `{ctx.clean_prefix}set api bayes"
+                                                        f" webhook_secret <SECRET>` first.")
+        await self.config.webhook_port.set(port)
+        await self.config.webhook_host.set(host)
+        await self.restart_loop()
+        await ctx.tick()
+
+    @mhtool.group(name='stats', invoke_without_command=True)
+    @commands.is_owner()
+    async def mh_stats(self, ctx):
+        """Show how long each part of the poll loop and each Bayes API call is taking"""
+        self.update_gauges()
+        for page in pagify(self.metrics.summary(), shorten_by=10):
+            await ctx.send(box(page))
+
+    @mh_stats.command(name='export')
+    async def mh_st_export(self, ctx, enable: bool):
+        """Write metrics to metrics.prom in this cog's data folder after every check
+
+        The file is in the Prometheus text format, for use with node exporter's textfile collector.
+        """
+        await self.config.prometheus_export.set(enable)
         await ctx.tick()
 
     @mhtool.group(name='channels', aliases=['channel'])
@@ -583,7 +786,7 @@ class BayesGAMH(commands.Cog):
         no_perms = []
         invalid_ids = []
 
-        async with self.config.invalid_games() as invalid_games:
+        async with self.invalid_games as invalid_games:
             for rpgid in (rpgid.strip(',') for rpgid in rpgids):
                 try:
                     game = await self.api.get_game(rpgid)
@@ -591,11 +794,11 @@ class BayesGAMH(commands.Cog):
                     invalid_ids.append(rpgid)
                     continue
 
-                if not await self.has_access(ctx.author, *game['tags']):
+                if not await self.has_access(ctx.author, *game.tags):
                     no_perms.append(rpgid)
                     continue
 
-                invalid_games[rpgid] = {'date': time.time()}
+                invalid_games.set(game, {'date': time.time()})
 
         badmsg = ""
         if invalid_ids:
@@ -614,11 +817,11 @@ class BayesGAMH(commands.Cog):
         did_action = False
 
         site = await login_if_possible(ctx, self.bot, 'lol')
-        async with self.config.invalid_games() as invalid_games:
+        async with self.invalid_games as invalid_games:
             for tag in (tag.strip() for tag in tags.split(',')):
-                games = await self.filter_new(site, await self.api.get_all_games(tag=tag))
+                games = await self.filter_new(site, await self.catalog.get_games(tag=tag))
                 for game in games:
-                    invalid_games[game['platformGameId']] = {'date': time.time()}
+                    invalid_games.set(game, {'date': time.time()})
                     did_action = True
 
         if not did_action:
@@ -627,70 +830,101 @@ class BayesGAMH(commands.Cog):
             await ctx.tick()
 
     async def format_game(self, game: Game, user: Optional[User]) -> str:
-        status = f" ({game['status']})" if game['status'] != "FINISHED" else ""
+        status = f" ({game.status})" if game.status != "FINISHED" else ""
 
-        return (f"`{game['platformGameId']}`{status} {self.get_asset_string(game['assets'])}\n"
-                f"\t\tName: {game['name']}\n"
-                f"\t\tStart Time: {self.parse_date(game['createdAt'])}\n"
-                f"\t\tTags: {', '.join(map(inline, sorted(game['tags'])))}")
+        return (f"`{game.game_id}`{status} {self.get_asset_string(game)}\n"
+                f"\t\tName: {game.name}\n"
+                f"\t\tStart Time: {self.parse_date(game.created)}\n"
+                f"\t\tTags: {', '.join(map(inline, sorted(game.tags)))}")
 
     async def format_game_long(self, game: Game, user: Optional[User]) -> str:
         subs = {} if user is None else await self.config.user(user).subscriptions()
-        use_spoiler_tags = any(data.get('spoiler') for sub, data in subs.items() if sub in game['tags'])
-        use_spoiler_tags = use_spoiler_tags or subs.get('ALL', {}).get('spoiler')
-
-        status = f" ({game['status']})" if game['status'] != "FINISHED" else ""
-        teams = winner = 'Unknown'
-        if 'GAMH_SUMMARY' in game['assets']:
-            summary = json.loads(await self.api.get_asset(game['platformGameId'], 'GAMH_SUMMARY'))
-            if len(summary['participants'][::5]) == 2:
-                t1, t2 = summary['participants'][::5]
-                teams = (f"{t1['summonerName'].split(' ')[0]} vs {t2['summonerName'].split(' ')[0]}")
-                winner = t1['summonerName'].split(' ')[0] if t1['win'] else t2['summonerName'].split(' ')[0]
-                if use_spoiler_tags:
-                    winner = spoiler(winner.ljust(30))
-        return (f"`{game['platformGameId']}`{status} {self.get_asset_string(game['assets'])}\n"
-                f"\t\tName: {game['name']}\n"
-                f"\t\tTeams: {teams}\n"
-                f"\t\tWinner: {winner}\n"
-                f"\t\tStart Time: {self.parse_date(game['createdAt'])}\n"
-                f"\t\tTags: {', '.join(map(inline, sorted(game['tags'])))}")
+        plain, spoilered = await self.render_game_long(game)
+        return spoilered if self.use_spoiler_tags(game, subs) else plain
+
+    async def render_game_long(self, game: Game) -> GameRender:
+        """Render a game once, both without and with spoiler tags around the winner"""
+        status = f" ({game.status})" if game.status != "FINISHED" else ""
+        teams = winner = spoiled_winner = 'Unknown'
+        if game.has_asset('GAMH_SUMMARY'):
+            summary = await self.get_summary(game)
+            if summary.teams is not None:
+                teams = ' vs '.join(summary.teams)
+                winner = summary.winner
+                spoiled_winner = spoiler(winner.ljust(30))
+
+        def render(winner_text: str) -> str:
+            return (f"`{game.game_id}`{status} {self.get_asset_string(game)}\n"
+                    f"\t\tName: {game.name}\n"
+                    f"\t\tTeams: {teams}\n"
+                    f"\t\tWinner: {winner_text}\n"
+                    f"\t\tStart Time: {self.parse_date(game.created)}\n"
+                    f"\t\tTags: {', '.join(map(inline, sorted(game.tags)))}")
+
+        return render(winner), render(spoiled_winner)
+
+    async def get_summary(self, game: Game) -> GameSummary:
+        """Get the parsed GAMH_SUMMARY of a game
+
+        Summaries of finished games don't change, so the most recently used SUMMARY_CACHE_SIZE of
+        them are kept.
+        """
+        if (summary := self.summaries.get(game.game_id)) is not None:
+            self.summaries.move_to_end(game.game_id)
+            return summary
+        summary = parse_summary(await self.api.get_asset(game.game_id, 'GAMH_SUMMARY', game=game))
+        if game.status == 'FINISHED':
+            self.summaries[game.game_id] = summary
+            if len(self.summaries) > SUMMARY_CACHE_SIZE:
+                self.summaries.popitem(last=False)
+        return summary
 
     @staticmethod
-    def get_asset_string(assets: List[AssetType]):
-        if 'GAMH_SUMMARY' in assets and 'GAMH_DETAILS' in assets:
+    def use_spoiler_tags(game: Game, subs: Dict[Tag, Dict[str, Any]]) -> bool:
+        return bool(any(data.get('spoiler') for sub, data in subs.items() if sub in game.tag_set)
+                    or subs.get('ALL', {}).get('spoiler'))
+
+    @staticmethod
+    def get_asset_string(game: Game):
+        if game.has_asset('GAMH_SUMMARY') and game.has_asset('GAMH_DETAILS'):
             return confirmation_message("Ready to parse")
-        elif 'GAMH_SUMMARY' in assets:
+        elif game.has_asset('GAMH_SUMMARY'):
             return confirmation_message("Ready to parse, but no drakes (Possible chronobreak. Please check back later)")
         else:
             return cancellation_message("Not ready to parse")
 
     @staticmethod
-    def parse_date(datestr: str) -> str:
-        return f"<t:{int(isoparse(datestr).timestamp())}:F>"
-
-    @staticmethod
-    async def filter_new(site: EsportsClient, games: Sequence[Game]) -> List[Game]:
-        """Returns only new games from a list of games."""
-        if not games:
-            return []
-
-        all_ids = [repr(game['platformGameId'].strip()) for game in games]
-        where = f"RiotPlatformGameId IN ({','.join(all_ids)})"
+    def parse_date(timestamp: float) -> str:
+        return f"<t:{int(timestamp)}:F>"
 
-        result = site.cargo_client.query(tables="MatchScheduleGame",
-                                         fields="RiotPlatformGameId",
-                                         where=where)
+    async def filter_new(self, site: EsportsClient, games: Sequence[Game]) -> List[Game]:
+        """Returns only new games from a list of games.
 
-        old_ids = [row['RiotPlatformGameId'] for row in result]
-        return [game for game in games if game['platformGameId'] not in old_ids]
+        Games don't leave the wiki once they're added, so IDs found on the wiki are remembered for
+        a day and aren't queried again.
+        """
+        now = time.time()
+        self.wiki_game_ids = {game_id: added for game_id, added in self.wiki_game_ids.items()
+                              if now - added < WIKI_GAME_ID_TTL}
+        unknown_ids = sorted({game.game_id.strip() for game in games} - self.wiki_game_ids.keys())
+
+        for idx in range(0, len(unknown_ids), WIKI_QUERY_CHUNK_SIZE):
+            where = f"RiotPlatformGameId IN ({','.join(map(repr, unknown_ids[idx:idx + WIKI_QUERY_CHUNK_SIZE]))})"
+            result = await self.bot.loop.run_in_executor(None, partial(site.cargo_client.query,
+                                                                       tables="MatchScheduleGame",
+                                                                       fields="RiotPlatformGameId",
+                                                                       where=where))
+            for row in result:
+                self.wiki_game_ids[row['RiotPlatformGameId']] = now
+
+        return [game for game in games if game.game_id.strip() not in self.wiki_game_ids]
 
     async def has_access(self, user, tag=None, *tags):
         tags = [tag] + list(tags)
         if has_perm('mhadmin', user, self.bot) or user.id in self.bot.owner_ids:
             return True
         for gtag in tags:
-            for utag in await self.config.user(user).allowed_tags():
+            for utag in await self.subscription_index.get_allowed_tags(user.id):
                 if utag == "ALL":
                     return True
                 if utag == gtag or utag == gtag.split(" ")[0]:
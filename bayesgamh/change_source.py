@@ -0,0 +1,101 @@
+import asyncio
+import hmac
+import logging
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from aiohttp import web
+
+logger = logging.getLogger('red.esports-wiki-cogs.bayesgamh')
+
+
+class ChangeSource(ABC):
+    """Decides when the poll loop should check Bayes for changed games"""
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def wait(self) -> None:
+        """Wait until games may have changed"""
+
+    def record_activity(self, active: bool) -> None:
+        """Report whether any games were live or recently created after a check"""
+
+
+class PollingChangeSource(ChangeSource):
+    """Check for changes on an interval that adapts to how much is going on
+
+    While games are active, checks happen every `min_interval` seconds.  Each idle check backs the
+    interval off by a factor of `backoff`, up to `max_interval` seconds.
+    """
+
+    def __init__(self, min_interval: float = 60, max_interval: Optional[float] = None, *, backoff: float = 1.5):
+        self.min_interval = min_interval
+        self.max_interval = min_interval if max_interval is None else max_interval
+        self.backoff = backoff
+
+        self.interval = min_interval
+        self._next: Optional[float] = None
+
+    def record_activity(self, active: bool) -> None:
+        if active:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+
+    async def wait(self) -> None:
+        now = asyncio.get_running_loop().time()
+        self._next = now + self.interval if self._next is None else max(self._next + self.interval, now)
+        await asyncio.sleep(self._next - now)
+
+
+class WebhookChangeSource(ChangeSource):
+    """Check for changes whenever a notification is pushed over HTTP
+
+    Any POST to `path` wakes the loop, as long as it has the shared secret in its
+    X-Webhook-Secret header.  Listen on a public `host` only when the port isn't reachable through a
+    proxy.  Notifications that arrive within `debounce` seconds of each other
+    only wake the loop once.  If nothing is pushed for `fallback_interval` seconds, the loop checks
+    anyway, in case a notification was lost.
+    """
+
+    def __init__(self, host: str, port: int, *, secret: str, path: str = '/bayes',
+                 debounce: float = 2, fallback_interval: float = 15 * 60):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.debounce = debounce
+        self.fallback_interval = fallback_interval
+
+        self.notified = asyncio.Event()
+        self.runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_notification)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+
+    async def close(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def handle_notification(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get('X-Webhook-Secret', ''), self.secret):
+            return web.Response(status=401)
+        self.notified.set()
+        return web.Response(status=204)
+
+    async def wait(self) -> None:
+        try:
+            await asyncio.wait_for(self.notified.wait(), self.fallback_interval)
+        except asyncio.TimeoutError:
+            return
+        await asyncio.sleep(self.debounce)
+        self.notified.clear()
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import random
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+import discord
+from discord.abc import Messageable
+
+from bayesgamh.metrics import Metrics
+
+logger = logging.getLogger('red.esports-wiki-cogs.bayesgamh')
+
+DRAIN_TIMEOUT = 30
+
+
+class DeliveryQueue:
+    """Send messages to Discord from a bounded pool of background workers
+
+    Messages to the same destination are always sent in the order they were queued.  Sends that
+    hit a rate limit or a server error are retried with exponential backoff.
+    """
+
+    def __init__(self, *, workers: int = 5, max_retries: int = 5, max_backoff: float = 60,
+                 metrics: Optional[Metrics] = None):
+        self.worker_count = workers
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.metrics = Metrics() if metrics is None else metrics
+
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.pending: Dict[int, Deque[Tuple[Messageable, str]]] = defaultdict(deque)
+        self.queued: Set[int] = set()
+        self.workers: List[asyncio.Task] = []
+
+    def put(self, destination: Messageable, *pages: str) -> None:
+        """Queue pages to be sent to a user or channel"""
+        if not pages:
+            return
+        if not self.workers:
+            self.workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        self.pending[destination.id].extend((destination, page) for page in pages)
+        if destination.id not in self.queued:
+            self.queued.add(destination.id)
+            self.queue.put_nowait(destination.id)
+
+    async def close(self, timeout: float = DRAIN_TIMEOUT) -> None:
+        """Give the workers up to `timeout` seconds to send what's already queued, then stop them"""
+        if self.workers:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Dropping undelivered messages to {len(self.pending)} destinations on close.")
+        for worker in self.workers:
+            worker.cancel()
+
+    async def _worker(self) -> None:
+        while True:
+            destination_id = await self.queue.get()
+            try:
+                # Only one worker drains a destination at a time, which keeps its messages in order
+                while self.pending[destination_id]:
+                    destination, page = self.pending[destination_id].popleft()
+                    if not await self._send(destination, page):
+                        self.pending[destination_id].clear()
+            except Exception:
+                logger.exception(f"Error delivering message to {destination_id}:")
+            finally:
+                self.pending.pop(destination_id, None)
+                self.queued.discard(destination_id)
+                self.queue.task_done()
+
+    async def _send(self, destination: Messageable, page: str) -> bool:
+        """Send a single page, returning whether further pages to this destination should be sent"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.metrics.timer('bayesgamh_phase_seconds', phase='deliver'):
+                    await destination.send(page)
+                self.metrics.inc('bayesgamh_messages_sent_total')
+                return True
+            except discord.Forbidden:
+                logger.warning(f"Unable to send subscription message to {destination}. (Forbidden)")
+                self.metrics.inc('bayesgamh_messages_failed_total', reason='forbidden')
+                return False
+            except discord.HTTPException as e:
+                if not (e.status == 429 or e.status >= 500) or attempt == self.max_retries:
+                    self.metrics.inc('bayesgamh_messages_failed_total', reason=e.status)
+                    raise
+                self.metrics.inc('bayesgamh_message_retries_total', status=e.status)
+                await asyncio.sleep(random.uniform(0, min(2 ** attempt, self.max_backoff)))
+        return False
@@ -0,0 +1,96 @@
+import asyncio
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from bayesgamh.bayes_api_wrapper import BayesAPIWrapper, Game, GameCursor, GameID, Tag
+
+
+class GameCatalog:
+    """An in-memory snapshot of all Bayes games, indexed by ID, tag, and creation time
+
+    The snapshot is kept up to date incrementally with a GameCursor.  Readers only go back to
+    the API once the snapshot is older than `ttl`.  Every index is sorted by creation time, so
+    date bounds only touch the games inside them.
+    """
+
+    def __init__(self, api: BayesAPIWrapper, *, ttl: timedelta = timedelta(seconds=60)):
+        self.api = api
+        self.ttl = ttl
+        self.cursor = GameCursor()
+
+        self.games: Dict[GameID, Game] = {}
+        self.by_tag: Dict[Tag, List[Tuple[float, GameID]]] = defaultdict(list)
+        self.by_created: List[Tuple[float, GameID]] = []
+
+        self.last_refresh: Optional[datetime] = None
+        self._refresh_lock = asyncio.Lock()
+
+    def is_stale(self) -> bool:
+        return self.last_refresh is None or datetime.now(timezone.utc) - self.last_refresh >= self.ttl
+
+    async def refresh(self, *, force: bool = False) -> None:
+        """Update the snapshot from the API if it's stale"""
+        async with self._refresh_lock:
+            if not (force or self.is_stale()):
+                return
+            full_sync = self.cursor.needs_full_sync()
+            games = await self.api.get_updated_games(self.cursor)
+            if full_sync:
+                self._rebuild(games)
+            else:
+                for game in games:
+                    self._add(game)
+            self.last_refresh = datetime.now(timezone.utc)
+
+    def _rebuild(self, games: List[Game]) -> None:
+        self.games = {game.game_id: game for game in games}
+        self.by_tag.clear()
+        self.by_created = []
+        for game in self.games.values():
+            key = (game.created, game.game_id)
+            self.by_created.append(key)
+            for tag in game.tags:
+                self.by_tag[tag].append(key)
+        self.by_created.sort()
+        for index in self.by_tag.values():
+            index.sort()
+
+    def _add(self, game: Game) -> None:
+        if game.game_id in self.games:
+            self._remove(game.game_id)
+        self.games[game.game_id] = game
+        key = (game.created, game.game_id)
+        for tag in game.tags:
+            insort(self.by_tag[tag], key)
+        insort(self.by_created, key)
+
+    def _remove(self, game_id: GameID) -> None:
+        game = self.games.pop(game_id)
+        key = (game.created, game_id)
+        for index in [self.by_tag[tag] for tag in game.tags] + [self.by_created]:
+            idx = bisect_left(index, key)
+            if idx < len(index) and index[idx] == key:
+                del index[idx]
+
+    async def get_games(self, *, tag: Optional[Tag] = None, since: Optional[datetime] = None) -> List[Game]:
+        """Get all games with the given filters, sorted by creation time
+
+        The special tag ALL matches every game and NULL matches games without tags, the same as
+        BayesAPIWrapper.get_all_games
+        """
+        return list(await self.iter_games(tag=tag, since=since))
+
+    async def iter_games(self, *, tag: Optional[Tag] = None, since: Optional[datetime] = None,
+                         newest_first: bool = False) -> Iterator[Game]:
+        """Lazily iterate over the games with the given filters, in order of creation time
+
+        Stop iterating as soon as enough games have been found, and the rest won't be looked at.  The
+        iterator works from a snapshot, so it stays valid if the catalog is refreshed in the meantime.
+        """
+        await self.refresh()
+        index = self.by_created if tag is None or tag == 'ALL' else self.by_tag.get(tag, [])
+        keys = index[0 if since is None else bisect_left(index, (since.timestamp(),)):]
+        games = self.games
+        return (games[game_id] for _, game_id in (reversed(keys) if newest_first else keys))
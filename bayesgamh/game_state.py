@@ -0,0 +1,124 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from redbot.core.config import Group
+
+from bayesgamh.bayes_api_wrapper import Game, GameID
+from bayesgamh.game_catalog import GameCatalog
+from bayesgamh.metrics import Metrics
+
+Bucket = str  # yyyy-mm of the games' createdAt
+
+
+class GameStateStore:
+    """Per-game state kept in Config, bucketed by the month each game was created
+
+    Use as an async context manager.  Only the buckets that changed are written back on exit, and
+    whole buckets can be pruned once they're older than the retention window.
+
+    Entries from the old flat `legacy` layout are filed under the month `catalog` says their game was
+    created in.  Entries for games that aren't in the catalog, or that were created before `cutoff`, are
+    dropped instead of being migrated.
+    """
+
+    def __init__(self, group: Group, legacy: Optional[Group] = None, *, catalog: Optional[GameCatalog] = None,
+                 cutoff: Optional[Callable[[], Awaitable[datetime]]] = None, metrics: Optional[Metrics] = None):
+        self.group = group
+        self.legacy = legacy
+        self.catalog = catalog
+        self.cutoff = cutoff
+        self.metrics = Metrics() if metrics is None else metrics
+
+        self.buckets: Optional[Dict[Bucket, Dict[GameID, Any]]] = None
+        self.index: Dict[GameID, Bucket] = {}
+        self.dirty: Set[Bucket] = set()
+        self.removed: Set[Bucket] = set()
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self) -> 'GameStateStore':
+        await self._lock.acquire()
+        try:
+            if self.buckets is None:
+                await self._load()
+        except BaseException:
+            self._lock.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        try:
+            with self.metrics.timer('bayesgamh_phase_seconds', phase='config_write'):
+                for bucket in self.removed:
+                    await self.group.clear_raw(bucket)
+                for bucket in self.dirty:
+                    await self.group.set_raw(bucket, value=self.buckets[bucket])
+            self.removed.clear()
+            self.dirty.clear()
+        finally:
+            self._lock.release()
+
+    async def _load(self) -> None:
+        self.buckets = await self.group()
+        for bucket, games in self.buckets.items():
+            for game_id in games:
+                self.index[game_id] = bucket
+
+        if self.legacy is not None and (legacy := await self.legacy()):
+            await self._migrate(legacy)
+            await self.legacy.clear()
+
+    async def _migrate(self, legacy: Dict[GameID, Any]) -> None:
+        # The old flat layout doesn't know when games were created, so look them up in the catalog
+        games = {}
+        if self.catalog is not None:
+            await self.catalog.refresh()
+            games = self.catalog.games
+        cutoff = None if self.cutoff is None else self.bucket_for(await self.cutoff())
+        migrated = set()
+        for game_id, value in legacy.items():
+            if game_id in self.index or game_id not in games:
+                continue
+            bucket = games[game_id].created_at[:7]
+            if cutoff is not None and bucket < cutoff:
+                continue
+            self.buckets.setdefault(bucket, {})[game_id] = value
+            self.index[game_id] = bucket
+            migrated.add(bucket)
+        for bucket in migrated:
+            await self.group.set_raw(bucket, value=self.buckets[bucket])
+
+    @staticmethod
+    def bucket_for(created: datetime) -> Bucket:
+        return created.strftime('%Y-%m')
+
+    def __contains__(self, game_id: GameID) -> bool:
+        return game_id in self.index
+
+    def get(self, game_id: GameID, default: Any = None) -> Any:
+        if game_id not in self.index:
+            return default
+        return self.buckets[self.index[game_id]][game_id]
+
+    def set(self, game: Game, value: Any) -> None:
+        bucket = game.created_at[:7]
+        if self.index.get(game.game_id, bucket) != bucket:
+            self.pop(game.game_id)
+        self.buckets.setdefault(bucket, {})[game.game_id] = value
+        self.index[game.game_id] = bucket
+        self.dirty.add(bucket)
+        self.removed.discard(bucket)
+
+    def pop(self, game_id: GameID) -> Any:
+        bucket = self.index.pop(game_id)
+        self.dirty.add(bucket)
+        return self.buckets[bucket].pop(game_id)
+
+    def prune(self, before: datetime) -> None:
+        """Drop every bucket from months earlier than `before`"""
+        cutoff = self.bucket_for(before)
+        for bucket in [bucket for bucket in self.buckets if bucket < cutoff]:
+            for game_id in self.buckets.pop(bucket):
+                del self.index[game_id]
+            self.dirty.discard(bucket)
+            self.removed.add(bucket)
@@ -0,0 +1,114 @@
+import math
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Dict, Iterator, List, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+
+class Histogram:
+    """Observations counted into fixed buckets, as in a Prometheus histogram"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket it falls in"""
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return math.inf
+
+
+class Metrics:
+    """Counters, gauges and latency histograms for the poll loop and the API wrapper"""
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[Labels, float]] = defaultdict(lambda: defaultdict(float))
+        self.gauges: Dict[str, Dict[Labels, float]] = defaultdict(dict)
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = defaultdict(dict)
+        self.started = time.time()
+
+    @staticmethod
+    def _labels(labels: Dict[str, object]) -> Labels:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        self.counters[name][self._labels(labels)] += value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        self.gauges[name][self._labels(labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self._labels(labels)
+        if key not in self.histograms[name]:
+            self.histograms[name][key] = Histogram()
+        self.histograms[name][key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def _format_labels(labels: Labels, **extra) -> str:
+        pairs = list(labels) + [(k, str(v)) for k, v in extra.items()]
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"'))
+                              for k, v in pairs) + '}'
+
+    def to_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines: List[str] = []
+        for name, values in sorted(self.counters.items()):
+            lines.append(f'# TYPE {name} counter')
+            lines.extend(f'{name}{self._format_labels(labels)} {value}' for labels, value in sorted(values.items()))
+        for name, values in sorted(self.gauges.items()):
+            lines.append(f'# TYPE {name} gauge')
+            lines.extend(f'{name}{self._format_labels(labels)} {value}' for labels, value in sorted(values.items()))
+        for name, values in sorted(self.histograms.items()):
+            lines.append(f'# TYPE {name} histogram')
+            for labels, hist in sorted(values.items()):
+                total = 0
+                for bound, count in zip(hist.buckets, hist.counts):
+                    total += count
+                    le = '+Inf' if bound == math.inf else bound
+                    lines.append(f'{name}_bucket{self._format_labels(labels, le=le)} {total}')
+                lines.append(f'{name}_sum{self._format_labels(labels)} {hist.sum}')
+                lines.append(f'{name}_count{self._format_labels(labels)} {hist.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        """Render a short human-readable summary of every metric"""
+        lines = [f"Collecting for {timedelta(seconds=int(time.time() - self.started))}"]
+        for name, values in sorted(self.histograms.items()):
+            lines.append(f"\n{name} (count / mean / p50 / p95)")
+            for labels, hist in sorted(values.items()):
+                mean = hist.sum / hist.count if hist.count else 0
+                lines.append(f"  {', '.join(v for _, v in labels) or '-'}: {hist.count} / {mean:.3f}s"
+                             f" / <{hist.quantile(.5)}s / <{hist.quantile(.95)}s")
+        for name, values in sorted(list(self.counters.items()) + list(self.gauges.items())):
+            lines.append(f"\n{name}")
+            for labels, value in sorted(values.items()):
+                lines.append(f"  {', '.join(v for _, v in labels) or '-'}: {value:g}")
+        return '\n'.join(lines)
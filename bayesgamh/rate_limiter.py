@@ -0,0 +1,99 @@
+import asyncio
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional
+
+
+class RateLimiter:
+    """An adaptive token bucket shared by every call to an API
+
+    The rate is halved whenever the API responds with a 429 and creeps back up with each successful
+    call.  A Retry-After header, or running out of requests in the current rate limit window,
+    pauses every caller until the server is ready again.
+    """
+
+    def __init__(self, *, rate: float = 10, burst: int = 10, min_rate: float = 0.5, max_rate: float = 20,
+                 default_retry_after: float = 5):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.default_retry_after = default_retry_after
+
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.waiting = 0
+        self.rate_limited = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Wait until a request may be made"""
+        self.waiting += 1
+        try:
+            # Waiters queue up on the lock, so they're let through in order
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    if now < self.paused_until:
+                        await asyncio.sleep(self.paused_until - now)
+                        continue
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+
+    def on_success(self, headers: Mapping[str, str]) -> None:
+        self.rate = min(self.max_rate, self.rate + 0.1)
+        if headers.get('X-RateLimit-Remaining') == '0' and (reset := self._parse_reset(headers)) is not None:
+            self._pause(reset)
+
+    def on_rate_limited(self, headers: Mapping[str, str]) -> None:
+        self.rate_limited += 1
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0
+        retry_after = self._parse_retry_after(headers)
+        if retry_after is None:
+            retry_after = self._parse_reset(headers)
+        self._pause(self.default_retry_after if retry_after is None else retry_after)
+
+    def _pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    @staticmethod
+    def _parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+        """Parse a Retry-After header, which is either a number of seconds or an HTTP date"""
+        if (value := headers.get('Retry-After')) is None:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _parse_reset(headers: Mapping[str, str]) -> Optional[float]:
+        """Parse an X-RateLimit-Reset header, which is either a number of seconds or an epoch time"""
+        try:
+            reset = float(headers['X-RateLimit-Reset'])
+        except (KeyError, ValueError):
+            return None
+        if reset > 10 ** 9:
+            reset -= time.time()
+        return max(reset, 0)
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            'rate': self.rate,
+            'tokens': self.tokens,
+            'waiting': self.waiting,
+            'rate_limited': self.rate_limited,
+            'paused_for': max(self.paused_until - time.monotonic(), 0),
+        }
@@ -0,0 +1,57 @@
+import asyncio
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Set
+
+from redbot.core import Config
+
+from bayesgamh.bayes_api_wrapper import Tag
+
+
+class SubscriptionIndex:
+    """An in-memory index of every user's subscriptions and allowed tags
+
+    The index is built from Config the first time it's used.  After that, reload_user must be
+    called whenever a user's data changes.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+
+        self.subscribers: Dict[Tag, Set[int]] = defaultdict(set)
+        self.subscriptions: Dict[int, Dict[Tag, Dict[str, Any]]] = {}
+        self.allowed_tags: Dict[int, Set[Tag]] = {}
+        self.jsononly: Dict[int, bool] = {}
+
+        self._built = False
+        self._build_lock = asyncio.Lock()
+
+    async def ensure_built(self) -> None:
+        async with self._build_lock:
+            if self._built:
+                return
+            for u_id, data in (await self.config.all_users()).items():
+                self._set_user(u_id, data)
+            self._built = True
+
+    async def reload_user(self, user_id: int) -> None:
+        """Update the index after a user's data has changed"""
+        if self._built:
+            self._set_user(user_id, await self.config.user_from_id(user_id).all())
+
+    def _set_user(self, user_id: int, data: Dict[str, Any]) -> None:
+        for tag in self.subscriptions.get(user_id, {}):
+            self.subscribers[tag].discard(user_id)
+        self.subscriptions[user_id] = data['subscriptions']
+        for tag in data['subscriptions']:
+            self.subscribers[tag].add(user_id)
+        self.allowed_tags[user_id] = set(data['allowed_tags'])
+        self.jsononly[user_id] = data['jsononly']
+
+    async def get_subscribers(self, tags: Iterable[Tag]) -> Set[int]:
+        """Get the IDs of all users subscribed to any of the tags"""
+        await self.ensure_built()
+        return self.subscribers['ALL'].union(*(self.subscribers.get(tag, ()) for tag in tags))
+
+    async def get_allowed_tags(self, user_id: int) -> Set[Tag]:
+        await self.ensure_built()
+        return self.allowed_tags.get(user_id, set())
@@ -0,0 +1,80 @@
+import json
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+PARTICIPANTS_RE = re.compile(rb'"participants"\s*:\s*\[')
+SUMMONER_NAME_RE = re.compile(rb'"summonerName"\s*:\s*("(?:[^"\\]|\\.)*")')
+WIN_RE = re.compile(rb'"win"\s*:\s*(true|false)')
+DURATION_RE = re.compile(rb'"gameDuration"\s*:\s*(\d+)')
+BRACKETS = (b'[', b'{', b']', b'}')
+
+PARTICIPANT_COUNT = 10
+
+
+class GameSummary(NamedTuple):
+    teams: Optional[Tuple[str, str]]
+    winner: Optional[str]
+    duration: Optional[int]  # Seconds
+
+
+def parse_summary(blob: bytes) -> GameSummary:
+    """Pull the teams, winner, and duration out of a GAMH_SUMMARY asset
+
+    Only the few fields that are needed are scanned for, one participant at a time, instead of
+    decoding the whole asset.  Unless that finds exactly one name and one result for each of the
+    ten participants, this falls back to parsing the full JSON.
+    """
+    if (participants := PARTICIPANTS_RE.search(blob)) is None:
+        return _parse_full_summary(blob)
+    names, wins = [], []
+    for start, end in _scan_objects(blob, participants.end()):
+        if blob.count(b'"summonerName"', start, end) != 1 or blob.count(b'"win"', start, end) != 1:
+            return _parse_full_summary(blob)
+        name, win = SUMMONER_NAME_RE.search(blob, start, end), WIN_RE.search(blob, start, end)
+        if name is None or win is None:
+            return _parse_full_summary(blob)
+        names.append(name[1])
+        wins.append(win[1])
+    if len(names) != PARTICIPANT_COUNT:
+        return _parse_full_summary(blob)
+
+    duration = DURATION_RE.search(blob)
+    t1, t2 = json.loads(names[0]).split(' ')[0], json.loads(names[5]).split(' ')[0]
+    return GameSummary((t1, t2), t1 if wins[0] == b'true' else t2, int(duration[1]) if duration else None)
+
+
+def _scan_objects(blob: bytes, start: int) -> List[Tuple[int, int]]:
+    """Find the spans of the objects in the JSON array opened just before `start`
+
+    Brackets are found with bytes.find rather than by tokenizing every string, which would cost
+    as much as decoding the JSON.  So brackets inside strings aren't skipped.  An unbalanced one
+    throws off the spans, but then they no longer hold exactly one participant each, and the
+    caller falls back to a full parse.
+    """
+    spans = []
+    depth, object_start = 1, start
+    upcoming = {bracket: blob.find(bracket, start) for bracket in BRACKETS}
+    while (found := [(pos, bracket) for bracket, pos in upcoming.items() if pos >= 0]):
+        pos, bracket = min(found)
+        upcoming[bracket] = blob.find(bracket, pos + 1)
+        if bracket in b'[{':
+            if depth == 1:
+                object_start = pos
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 1:
+                spans.append((object_start, pos + 1))
+            elif depth == 0:
+                return spans
+    return []
+
+
+def _parse_full_summary(blob: bytes) -> GameSummary:
+    summary = json.loads(blob)
+    duration = summary.get('gameDuration')
+    if len(summary.get('participants', [])[::5]) != 2:
+        return GameSummary(None, None, duration)
+    p1, p2 = summary['participants'][::5]
+    t1, t2 = p1['summonerName'].split(' ')[0], p2['summonerName'].split(' ')[0]
+    return GameSummary((t1, t2), t1 if p1['win'] else t2, duration)
@@ -0,0 +1,204 @@
+"""Benchmarks for the bayesgamh poll loop, run against a local stand-in for the Bayes API
+
+Run from the repository root, with Red and the cogs' requirements installed:
+
+    python benchmarks/bayesgamh_bench.py --games 5000 --subscribers 300
+
+Each scenario reports wall time, the requests the fake API served, the messages that were
+delivered, and the peak memory traced while it ran.  Tracing memory slows everything down, so
+pass --no-memory when comparing wall times.  Requests go through the same rate limiter as in
+production unless --rate is raised, in which case the numbers show the cost of the cog itself.
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from redbot.core import _drivers as drivers, data_manager  # noqa: E402
+
+from fake_bayes import FakeBayes, make_games, push_notification  # noqa: E402
+
+
+class FakeMessageable:
+    def __init__(self, id: int):
+        self.id = id
+        self.sent = 0
+
+    async def send(self, content: str) -> None:
+        self.sent += 1
+        await asyncio.sleep(0)
+
+
+class FakeBot:
+    """Just enough of Red for BayesGAMH to run its poll loop"""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.owner_ids = set()
+        self.users: Dict[int, FakeMessageable] = {}
+        self.channels: Dict[int, FakeMessageable] = {}
+
+    def get_user(self, user_id: int) -> FakeMessageable:
+        return self.users.setdefault(user_id, FakeMessageable(user_id))
+
+    def get_channel(self, channel_id: int) -> FakeMessageable:
+        return self.channels.setdefault(channel_id, FakeMessageable(channel_id))
+
+    def get_cog(self, name: str) -> None:
+        return None
+
+    async def get_shared_api_tokens(self, service: str) -> Dict[str, str]:
+        return {'username': 'benchmark', 'password': 'benchmark'}
+
+    async def get_valid_prefixes(self) -> List[str]:
+        return ['!']
+
+    def messages_sent(self) -> int:
+        return sum(dest.sent for dest in (*self.users.values(), *self.channels.values()))
+
+
+async def setup_red(data_path: str) -> None:
+    """Point Red's Config at a throwaway JSON store"""
+    data_manager.basic_config = dict(data_manager.basic_config_default, DATA_PATH=data_path,
+                                     STORAGE_TYPE='JSON', STORAGE_DETAILS={})
+    await drivers.get_driver_class(drivers.BackendType.JSON).initialize()
+
+
+async def add_subscribers(cog, count: int, tags: List[str], rng: random.Random) -> None:
+    for user_id in range(1, count + 1):
+        user = cog.config.user_from_id(user_id)
+        subs = rng.sample(tags, min(len(tags), rng.randint(1, 5)))
+        if rng.random() < .05:
+            subs.append('ALL')
+        await user.subscriptions.set({tag: {'date': 0, 'spoiler': rng.random() < .3} for tag in subs})
+        await user.allowed_tags.set({'ALL': {'date': 0}} if rng.random() < .5 else {tag: {'date': 0} for tag in subs})
+        await user.jsononly.set(rng.random() < .5)
+
+
+async def tick(cog) -> None:
+    """One pass of the poll loop, waiting until every message has been delivered"""
+    await cog.catalog.refresh(force=True)
+    renders = {}
+    await cog.do_auto_channel(renders)
+    await cog.do_subscriptions(renders)
+    await cog.delivery.queue.join()
+
+
+async def pushed_tick(cog, source, url: str) -> None:
+    """Push a notification to the webhook listener, then tick once it wakes the loop"""
+    woken = asyncio.create_task(source.wait())
+    await asyncio.sleep(0)
+    if (status := await push_notification(url, 'benchmark')) != 204:
+        raise RuntimeError(f"The webhook listener answered {status}")
+    await woken
+    await tick(cog)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def measure(name: str, fake: FakeBayes, bot: FakeBot, func: Callable[[], Awaitable[Any]],
+                  trace_memory: bool) -> Dict[str, Any]:
+    requests = fake.requests.copy()
+    sent = bot.messages_sent()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        await func()
+    finally:
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        tracemalloc.stop()
+    return {'name': name, 'seconds': elapsed, 'requests': fake.requests - requests,
+            'messages': bot.messages_sent() - sent, 'peak': peak}
+
+
+def report(results: List[Dict[str, Any]]) -> None:
+    for result in results:
+        peak = 'n/a' if result['peak'] is None else f"{result['peak'] / 2 ** 20:.1f} MiB"
+        print(f"{result['name']:<28} {result['seconds']:8.2f}s  peak {peak:>10}  messages {result['messages']:>6}")
+        for path, count in sorted(result['requests'].items()):
+            print(f"    {path:<32} {count:>6}")
+
+
+async def run(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as data_path:
+        await setup_red(data_path)
+        from bayesgamh.bayesgamh import BayesGAMH
+        from bayesgamh.bayes_api_wrapper import BayesAPIWrapper
+        from bayesgamh.change_source import WebhookChangeSource
+        from bayesgamh.rate_limiter import RateLimiter
+
+        games = make_games(args.games, tags=args.tags, seed=args.seed)
+        fake = FakeBayes(games[2 * args.new_games:], fail_every=args.fail_every, token_uses=args.token_uses)
+        url = await fake.start()
+        bot = FakeBot()
+
+        cog = BayesGAMH(bot)
+        cog._loop.cancel()
+        await cog.api.close()
+        cog.api = cog.catalog.api = BayesAPIWrapper(bot, asset_path=os.path.join(data_path, 'assets'), base_url=url,
+                                                    metrics=cog.metrics)
+        if args.rate is not None:
+            cog.api.rate_limiter = RateLimiter(rate=args.rate, burst=int(args.rate), max_rate=args.rate)
+        await add_subscribers(cog, args.subscribers, sorted({t for g in games for t in g['tags']}), rng)
+        async with cog.config.auto_channels() as channels:
+            for channel_id in range(args.auto_channels):
+                channels[str(channel_id)] = {'date': 0}
+
+        api = BayesAPIWrapper(bot, asset_path=os.path.join(data_path, 'bench_assets'), base_url=url)
+        results = [await measure('get_all_games', fake, bot, api.get_all_games, args.memory)]
+        await api.close()
+        results.append(await measure('first tick', fake, bot, lambda: tick(cog), args.memory))
+        fake.add_games(games[args.new_games:2 * args.new_games])
+        results.append(await measure(f'tick with {args.new_games} new games', fake, bot, lambda: tick(cog),
+                                     args.memory))
+        results.append(await measure('idle tick', fake, bot, lambda: tick(cog), args.memory))
+        port = free_port()
+        source = WebhookChangeSource('127.0.0.1', port, secret='benchmark', debounce=0)
+        await source.start()
+        fake.add_games(games[:args.new_games])
+        results.append(await measure(f'pushed tick with {args.new_games} new games', fake, bot,
+                                     lambda: pushed_tick(cog, source, f'http://127.0.0.1:{port}/bayes'),
+                                     args.memory))
+        await source.close()
+        report(results)
+
+        await cog.close()
+        await fake.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=3000, help="Games served by the fake API")
+    parser.add_argument('--new-games', type=int, default=20,
+                        help="Games added before the second tick, and again before the pushed one")
+    parser.add_argument('--tags', type=int, default=50, help="Distinct tags spread across the games")
+    parser.add_argument('--subscribers', type=int, default=200, help="Users with subscriptions")
+    parser.add_argument('--auto-channels', type=int, default=3, help="Channels that get every game")
+    parser.add_argument('--fail-every', type=int, default=None,
+                        help="Answer every Nth API request with a 429")
+    parser.add_argument('--token-uses', type=int, default=None,
+                        help="Reject access tokens with a 401 after this many requests")
+    parser.add_argument('--rate', type=float, default=None,
+                        help="Requests per second allowed by the rate limiter, instead of the default")
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help="Don't trace peak memory")
+    parser.add_argument('--seed', type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
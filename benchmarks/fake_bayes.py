@@ -0,0 +1,156 @@
+import json
+import random
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from aiohttp import ClientSession, web
+from dateutil.parser import isoparse
+
+ASSET_TYPES = ['GAMH_SUMMARY', 'GAMH_DETAILS', 'ROFL_REPLAY']
+
+
+def make_games(count: int, *, tags: int = 50, spacing: timedelta = timedelta(minutes=20),
+               seed: int = 0) -> List[Dict[str, Any]]:
+    """Generate `count` games, newest first, created `spacing` apart up until now"""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    games = []
+    for i in range(count):
+        created = now - spacing * i
+        games.append({
+            'platformGameId': f'ESPORTSTMNT01_{count - i}',
+            'name': f'Game {count - i}',
+            'status': 'FINISHED' if i > 2 else 'LIVE',
+            'createdAt': created.isoformat().replace('+00:00', 'Z'),
+            'assets': [asset for asset in ASSET_TYPES if rng.random() < .8],
+            'tags': rng.sample([f'LEAGUE{t} 2022' for t in range(tags)], rng.randint(0, 2)),
+            'blockName': f'Week {i % 9 + 1}',
+            'subBlockName': f'Day {i % 3 + 1}',
+            'teamTriCodes': [],
+        })
+    return games
+
+
+def make_summary(game_id: str) -> bytes:
+    """A GAMH_SUMMARY shaped like the real one, padded out to a realistic size"""
+    rng = random.Random(game_id)
+    team1, team2 = rng.sample(['T1', 'GEN', 'DK', 'KT', 'HLE', 'DRX', 'NS', 'LSB', 'BRO', 'KDF'], 2)
+    first_won = rng.random() < .5
+    participants = [{'participantId': i + 1,
+                     'summonerName': f'{team1 if i < 5 else team2} Player{i}',
+                     'win': (i < 5) == first_won,
+                     'perks': {'styles': [{'selections': [{'perk': rng.randint(8000, 9000)} for _ in range(4)]}]},
+                     'stats': {f'stat{j}': rng.randint(0, 10000) for j in range(100)}}
+                    for i in range(10)]
+    return json.dumps({'gameDuration': rng.randint(1200, 2700), 'gameId': game_id,
+                       'participants': participants}).encode()
+
+
+async def push_notification(url: str, secret: str) -> int:
+    """POST a change notification to a webhook listener the way Bayes would, returning the status"""
+    async with ClientSession() as session:
+        async with session.post(url, headers={'X-Webhook-Secret': secret}) as resp:
+            return resp.status
+
+
+class FakeBayes:
+    """A local stand-in for emh-api.bayesesports.com
+
+    Serves login, tags, paged games, single games, and asset downloads from generated data.
+    Every `fail_every`-th API request is answered with a 429, and access tokens stop working after
+    `token_uses` requests, so that rate limiting and re-logins are exercised too.
+    """
+
+    def __init__(self, games: List[Dict[str, Any]], *, fail_every: Optional[int] = None,
+                 token_uses: Optional[int] = None, retry_after: float = .1):
+        self.games = games
+        self.by_id = {game['platformGameId']: game for game in games}
+        self.fail_every = fail_every
+        self.token_uses = token_uses
+        self.retry_after = retry_after
+
+        self.requests: Counter = Counter()
+        self.token = None
+        self.token_count = 0
+        self.url: Optional[str] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        app = web.Application(middlewares=[self.count_requests])
+        app.router.add_post('/login', self.login)
+        app.router.add_post('/login/refresh_token', self.login)
+        app.router.add_get('/api/v1/tags', self.get_tags)
+        app.router.add_get('/api/v1/games', self.get_games)
+        app.router.add_get('/api/v1/games/{game_id}', self.get_game)
+        app.router.add_get('/api/v1/games/{game_id}/download', self.get_download)
+        app.router.add_get('/assets/{game_id}/{asset}', self.get_asset)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://{host}:{port}/'
+        return self.url
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def add_games(self, games: List[Dict[str, Any]]) -> None:
+        self.games[:0] = games
+        self.by_id.update((game['platformGameId'], game) for game in games)
+
+    @web.middleware
+    async def count_requests(self, request: web.Request, handler):
+        name = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+        self.requests[name] += 1
+        if request.path.startswith('/api/'):
+            if self.fail_every and sum(self.requests.values()) % self.fail_every == 0:
+                self.requests['HTTP 429'] += 1
+                return web.Response(status=429, headers={'Retry-After': str(self.retry_after)})
+            if request.headers.get('Authorization') != f'Bearer {self.token}':
+                self.requests['HTTP 401'] += 1
+                return web.Response(status=401)
+            self.token_count += 1
+            if self.token_uses and self.token_count >= self.token_uses:
+                self.token = None
+        return await handler(request)
+
+    async def login(self, request: web.Request) -> web.Response:
+        self.token = f'token{self.requests["/login"] + self.requests["/login/refresh_token"]}'
+        self.token_count = 0
+        return web.json_response({'accessToken': self.token, 'refreshToken': 'refresh', 'expiresIn': 3600})
+
+    async def get_tags(self, request: web.Request) -> web.Response:
+        return web.json_response(sorted({tag for game in self.games for tag in game['tags']}))
+
+    async def get_games(self, request: web.Request) -> web.Response:
+        games = self.games
+        if 'from_timestamp' in request.query:
+            start = isoparse(request.query['from_timestamp'])
+            games = [game for game in games if isoparse(game['createdAt']) >= start]
+        if 'to_timestamp' in request.query:
+            end = isoparse(request.query['to_timestamp'])
+            games = [game for game in games if isoparse(game['createdAt']) <= end]
+        if 'tags' in request.query:
+            tags = set(request.query['tags'].split(','))
+            games = [game for game in games if tags.intersection(game['tags'])]
+        # Pages are numbered from 1, and the unpaged request gets the first one
+        page, size = int(request.query.get('page', 1)), int(request.query.get('size', 20))
+        return web.json_response({'page': page, 'size': size, 'count': len(games),
+                                  'games': games[(page - 1) * size:page * size]})
+
+    async def get_game(self, request: web.Request) -> web.Response:
+        if (game := self.by_id.get(request.match_info['game_id'])) is None:
+            return web.Response(status=404)
+        return web.json_response(game)
+
+    async def get_download(self, request: web.Request) -> web.Response:
+        game_id, asset = request.match_info['game_id'], request.query['type']
+        if asset not in self.by_id.get(game_id, {}).get('assets', []):
+            return web.Response(status=404)
+        return web.json_response({'url': f'{self.url}assets/{game_id}/{asset}'})
+
+    async def get_asset(self, request: web.Request) -> web.Response:
+        return web.Response(body=make_summary(request.match_info['game_id']))
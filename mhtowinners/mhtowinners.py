@@ -29,14 +29,23 @@ class MhToWinners(commands.Cog):
         await self._do_the_thing(ctx, VodsToSbRunner, vod_params)
 
     async def _do_the_thing(self, ctx, the_thing, *args):
-        await ctx.send('Okay, starting now!')
+        # AutoRosters owns the job queue, so that runners from both cogs share one pool and one queue per wiki
+        if (autorosters := self.bot.get_cog("AutoRosters")) is None:
+            return await ctx.send('The AutoRosters cog must be loaded to run this command.')
+        job_queue = autorosters.job_queue
         credentials = await get_credentials(ctx, self.bot)
-        site = EsportsClient('lol', credentials=credentials,
-                             max_retries_mwc=0,
-                             max_retries=2, retry_interval=10)
+        job_queue.start(ctx, self._run_the_thing(ctx, job_queue, credentials, the_thing, *args))
+
+    async def _run_the_thing(self, ctx, job_queue, credentials, the_thing, *args):
+        def run():
+            site = EsportsClient('lol', credentials=credentials,
+                                 max_retries_mwc=0,
+                                 max_retries=2, retry_interval=10)
+            the_thing(site, *args).run()
+
         try:
             async with StatusManager(self.bot):
-                the_thing(site, *args).run()
+                await job_queue.run(ctx, 'lol', the_thing.__name__, run)
         except ReadTimeout:
             return await ctx.send('Whoops, the site is taking too long to respond, try again later')
         await ctx.send('Okay, done!')